@@ -0,0 +1,87 @@
+"""OAuth credentials for the Google Code issue tracker, shared across fetch workers."""
+
+import datetime
+import threading
+
+import profiling
+
+CLIENT_SECRETS = 'client_secrets.json'
+OAUTH2_STORAGE = 'oauth2.dat'
+ISSUE_TRACKER_SCOPE = 'https://code.google.com/feeds/issues'
+
+# Refresh the access token when it has less than this long left.
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+
+def load_credentials(client_secrets=CLIENT_SECRETS, storage_path=OAUTH2_STORAGE):
+    """Return oauth2client credentials for ISSUE_TRACKER_SCOPE.
+
+    Credentials are read from `storage_path`. If they do not exist, a sign-in
+    flow is opened using the client ID in `client_secrets`.
+    """
+    # The auth stack is slow to import, so only load it for authorized runs
+    import argparse
+    from oauth2client import tools
+    from oauth2client.client import flow_from_clientsecrets
+    from oauth2client.file import Storage
+    from oauth2client.tools import run_flow
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        parents=[tools.argparser])
+    flags = parser.parse_args([])
+
+    # Perform OAuth 2.0 authorization.
+    flow = flow_from_clientsecrets(client_secrets, scope=ISSUE_TRACKER_SCOPE)
+    storage = Storage(storage_path)
+    credentials = storage.get()
+
+    if credentials is None or credentials.invalid:
+        credentials = run_flow(flow, storage, flags)
+    return credentials
+
+
+class CredentialManager(object):
+    """Load credentials once per run and hand out a bearer token to every worker.
+
+    The token is refreshed (and written back to storage) shortly before it
+    expires, under a lock so concurrent workers only refresh it once.
+    """
+
+    def __init__(self, client_secrets=CLIENT_SECRETS, storage_path=OAUTH2_STORAGE,
+                 refresh_margin=REFRESH_MARGIN):
+        self._client_secrets = client_secrets
+        self._storage_path = storage_path
+        self._refresh_margin = refresh_margin
+        self._credentials = None
+        self._lock = threading.Lock()
+
+    def _expiring(self):
+        """Test whether the current token is missing or about to expire."""
+        credentials = self._credentials
+        if credentials.access_token is None or credentials.access_token_expired:
+            return True
+        if credentials.token_expiry is None:
+            return False
+        return credentials.token_expiry - datetime.datetime.utcnow() < self._refresh_margin
+
+    def access_token(self, stale_token=None):
+        """Get a valid access token, loading or refreshing the credentials if needed.
+
+        `stale_token` is a token the server rejected. It is only refreshed if
+        it is still the current token, so when a burst of requests is
+        rejected the first worker refreshes it and the rest get the new one.
+        """
+        with self._lock, profiling.phase("auth"):
+            if self._credentials is None:
+                self._credentials = load_credentials(self._client_secrets, self._storage_path)
+            rejected = stale_token is not None and stale_token == self._credentials.access_token
+            if rejected or self._expiring():
+                import httplib2
+                self._credentials.refresh(httplib2.Http())
+            return self._credentials.access_token
+
+
+def authorization_headers(token):
+    """Get the headers to authorize a request with the access token."""
+    return {"Authorization": "Bearer {token}".format(token=token)}
@@ -0,0 +1,206 @@
+#!/usr/bin/python
+"""Offline benchmarks for parsing, property extraction and aggregation.
+
+Usage:
+  benchmark.py [options]
+
+Options:
+  -h --help            Show this screen.
+  --sizes=<LIST>       Comma-separated numbers of issues [default: 1000,10000].
+  --repeat=<N>         Runs per benchmark; the fastest is kept [default: 3].
+  --output=<FILE>      Write the results as JSON to FILE.
+  --baseline=<FILE>    Compare the results with an earlier --output file.
+  --startup            Time CLI startup instead, failing if slow imports load eagerly.
+
+Every benchmark runs on a deterministic synthetic feed (see synthetic.py), so
+results from different checkouts can be compared. Sizes of 100000 and
+1000000 are realistic for large projects but take a while.
+
+--startup times fresh interpreters running issues.py --help and importing
+issues, and checks that importing issues doesn't load any of LAZY_MODULES.
+"""
+
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from docopt import docopt
+
+from columns import IssueTable
+from history import IssueHistory
+from issues import PROPERTY_FUNCTIONS
+from query import get_issues_from_page, parse_page
+from snapshot import load_snapshot, write_snapshot
+import synthetic
+import utils
+from visualizers import ChangeTracker, GridTracker, print_quantiles
+
+QUANTILES = [99, 90, 75, 50, 25, 0]
+HISTORY_DAYS = 365
+HISTORY_STEP_DAYS = 7
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+STARTUP_COMMANDS = [
+    ("issues.py --help", ["issues.py", "--help"]),
+    ("import issues", ["-c", "import issues"]),
+]
+# Slow imports that should only load once the chosen options need them
+LAZY_MODULES = ["oauth2client", "numpy", "httplib2", "multiprocessing", "cProfile"]
+
+
+def best_time(fn, repeat):
+    """Run fn `repeat` times and return the fastest wall time in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        fn()
+        times.append(timeit.default_timer() - start)
+    return min(times)
+
+def parse_all(synthetic_issues):
+    """Parse the feed pages for the synthetic issues. Return (seconds spent parsing, issues).
+
+    Pages are rendered one at a time and only parsing is timed, so even the
+    largest sizes don't need the whole feed in memory.
+    """
+    elapsed = 0.0
+    issues = []
+    for page in synthetic.generate_pages(synthetic_issues):
+        start = timeit.default_timer()
+        issues += get_issues_from_page(parse_page(page))
+        elapsed += timeit.default_timer() - start
+    return (elapsed, issues)
+
+def run_trackers(history, start, end, trackers):
+    """Feed precomputed history changes to the trackers."""
+    start_issues = history.open_on_date(start)
+    changes = history.changes_for_range(start, end, HISTORY_STEP_DAYS)
+    def run():
+        """Run the trackers over the changes."""
+        for tracker in trackers():
+            tracker.start(start, start_issues)
+            for (date, opened_issues, closed_issues) in changes:
+                tracker.step(date, opened_issues, closed_issues)
+    return run
+
+def run_benchmarks(num_issues, repeat):
+    """Run every benchmark for a feed with num_issues issues. Returns {name: seconds}."""
+    results = {}
+    synthetic_issues = synthetic.generate_issues(num_issues)
+
+    parse_times = []
+    for _ in range(repeat):
+        (elapsed, issues) = parse_all(synthetic_issues)
+        parse_times.append(elapsed)
+    results["get_issues_from_page"] = min(parse_times)
+    del synthetic_issues
+
+    for (prop, (prop_fn, tipe)) in sorted(PROPERTY_FUNCTIONS.items()):
+        results["getter:" + prop] = best_time(lambda: map(prop_fn, issues), repeat)
+        if tipe is list:
+            group = lambda: utils.group_issues_by_list_prop(issues, prop_fn)
+        else:
+            group = lambda: utils.group_issues_by_prop(issues, prop_fn)
+        results["group_issues_by_prop:" + prop] = best_time(group, repeat)
+
+    devnull = open(os.devnull, "w")
+    stdout = sys.stdout
+    for prop in ["published", "updated", "stars"]:
+        (prop_fn, _) = PROPERTY_FUNCTIONS[prop]
+        sys.stdout = devnull
+        try:
+            results["print_quantiles:" + prop] = best_time(
+                lambda: print_quantiles(map(prop_fn, issues), QUANTILES, reverse=True), repeat)
+        finally:
+            sys.stdout = stdout
+    devnull.close()
+
+    results["IssueTable"] = best_time(lambda: IssueTable(issues), repeat)
+    table = IssueTable(issues)
+    (fd, snapshot_path) = tempfile.mkstemp(suffix=".snap")
+    os.close(fd)
+    try:
+        results["snapshot:write"] = best_time(lambda: write_snapshot(snapshot_path, table), repeat)
+        results["snapshot:load"] = best_time(lambda: load_snapshot(snapshot_path), repeat)
+    finally:
+        os.remove(snapshot_path)
+
+    end = datetime.date.fromordinal(max(issue.published for issue in issues))
+    start = end - datetime.timedelta(days=HISTORY_DAYS)
+    history = IssueHistory(issues)
+    results["ChangeTracker"] = best_time(
+        run_trackers(history, start, end, lambda: [ChangeTracker()]), repeat)
+    for prop in ["priority", "owner"]:
+        (prop_fn, _) = PROPERTY_FUNCTIONS[prop]
+        results["GridTracker:" + prop] = best_time(
+            run_trackers(history, start, end, lambda: [GridTracker(prop_fn)]), repeat)
+    return results
+
+def run_startup_benchmarks(repeat):
+    """Time each of the STARTUP_COMMANDS in a fresh interpreter. Returns {name: seconds}."""
+    results = {}
+    devnull = open(os.devnull, "w")
+    for (name, args) in STARTUP_COMMANDS:
+        run = lambda: subprocess.check_call([sys.executable] + args, cwd=REPO_DIR, stdout=devnull)
+        results["startup:" + name] = best_time(run, repeat)
+    devnull.close()
+    return results
+
+def eager_imports():
+    """Get the LAZY_MODULES that importing issues loads."""
+    code = "import sys, issues; print ' '.join(m for m in {modules!r} if m in sys.modules)"
+    output = subprocess.check_output(
+        [sys.executable, "-c", code.format(modules=LAZY_MODULES)], cwd=REPO_DIR)
+    return output.split()
+
+def print_results(results, baseline=None):
+    """Print the results, with the ratio to the baseline where there is one."""
+    baseline = baseline or {}
+    for size in sorted(results, key=lambda size: int(size) if size.isdigit() else -1):
+        if size.isdigit():
+            print "\n== {size} issues ==".format(size=size)
+        else:
+            print "\n== {size} ==".format(size=size)
+        for (name, seconds) in sorted(results[size].items()):
+            line = "{name:<36} {seconds:10.4f}s".format(name=name, seconds=seconds)
+            old = baseline.get(size, {}).get(name)
+            if old:
+                line += "  {ratio:6.2f}x baseline ({old:.4f}s)".format(ratio=seconds / old, old=old)
+            print line
+
+def main():
+    """Run the benchmarks."""
+    arguments = docopt(__doc__)
+    sizes = [int(size) for size in arguments["--sizes"].split(",")]
+    repeat = int(arguments["--repeat"])
+
+    results = {}
+    if arguments["--startup"]:
+        results["startup"] = run_startup_benchmarks(repeat)
+    else:
+        for size in sizes:
+            results[str(size)] = run_benchmarks(size, repeat)
+
+    baseline = None
+    if arguments["--baseline"] is not None:
+        with open(arguments["--baseline"]) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if arguments["--output"] is not None:
+        with open(arguments["--output"], "w") as f:
+            json.dump({"python": sys.version.split()[0], "repeat": repeat, "results": results},
+                      f, indent=2, sort_keys=True)
+
+    if arguments["--startup"]:
+        eager = eager_imports()
+        if len(eager) > 0:
+            print "\nImporting issues loads: " + ", ".join(eager)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""In-memory cache of fetched results that coalesces concurrent identical requests."""
+
+from collections import OrderedDict
+import sys
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL = 300  # seconds
+
+
+def result_size(value):
+    """Get the size of a result in bytes: its `size` (e.g. a FeedPage's), else its length."""
+    size = getattr(value, "size", None)
+    return size if size is not None else len(value)
+
+
+class _Flight(object):
+    """A load in progress that other callers for the same key can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class ResultCache(object):
+    """A thread-safe LRU cache of at most `max_bytes` whose entries expire after `ttl` seconds.
+
+    Entries are sized with `size_of`. If several threads ask for the same
+    missing key at once, only the first one loads it; the others wait for
+    and share its result.
+        cache = ResultCache()
+        page = cache.get_or_load(url, lambda: fetch(url))
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, size_of=result_size,
+                 clock=time.time):
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._size_of = size_of
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expiry, value, size), least recently used first
+        self._bytes = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expirations": 0}
+
+    def _lookup(self, key):
+        """Get the live entry for key, or None. Must be called with the lock held."""
+        if key not in self._entries:
+            return None
+        (expiry, value, size) = self._entries.pop(key)
+        if expiry <= self._clock():
+            self._bytes -= size
+            self._stats["expirations"] += 1
+            return None
+        self._entries[key] = (expiry, value, size)
+        return value
+
+    def get(self, key):
+        """Get the value for key, or None if it isn't cached."""
+        with self._lock:
+            value = self._lookup(key)
+            self._stats["hits" if value is not None else "misses"] += 1
+            return value
+
+    def put(self, key, value, size=None):
+        """Store the value, of `size` bytes (by default, its size_of)."""
+        self._put(key, value, size if size is not None else self._size_of(value))
+
+    def get_or_load(self, key, load):
+        """Get the value for key, calling load() to compute it on a miss."""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self._stats["hits"] += 1
+                return value
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats["coalesced"] += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                self._stats["misses"] += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.exc_info is not None:
+                raise flight.exc_info[0], flight.exc_info[1], flight.exc_info[2]
+            return flight.result
+
+        try:
+            flight.result = load()
+        except Exception:
+            flight.exc_info = sys.exc_info()
+            raise
+        else:
+            self._put(key, flight.result, self._size_of(flight.result))
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def _put(self, key, value, size):
+        """Store the value, evicting the least recently used entries until the cache fits."""
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[2]
+            if size > self._max_bytes:
+                return
+            self._entries[key] = (self._clock() + self._ttl, value, size)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                (_, (_, _, evicted_size)) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        """Drop every cached entry."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Get the hit/miss statistics, plus the current number of entries and their size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        return stats
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache():
+    """Get the ResultCache shared by queries that weren't given one."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache()
+        return _default_cache
+
+def set_default_cache(cache):
+    """Set the ResultCache shared by queries that weren't given one."""
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
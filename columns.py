@@ -0,0 +1,303 @@
+"""Columnar view of a set of issues for vectorized counts, groups and quantiles."""
+
+import datetime
+
+import numpy as np
+
+from quantiles import exact_quantiles
+import utils
+
+# <property>: (<column kind>, <value getter>)
+#   category -- one value per issue, integer-coded against a list of distinct values
+#   int      -- integer values with a null mask
+#   date     -- day ordinals with a null mask; values are shown as YYYY-MM-DD
+#   multi    -- any number of values per issue, integer-coded, stored as offsets + codes
+COLUMNS = {
+    "owner": ("category", utils.get_issue_owner),
+    "status": ("category", utils.get_issue_status),
+    "type": ("category", utils.get_issue_type),
+    "priority": ("int", utils.get_issue_priority),
+    "milestone": ("int", utils.get_issue_milestone),
+    "stars": ("int", utils.get_issue_stars),
+    "published": ("date", lambda issue: issue.published),
+    "updated": ("date", lambda issue: issue.updated),
+    "label": ("multi", lambda issue: utils.get_issue_labels_by_prefix("Cr-", issue)),
+}
+# <column kind>: <function converting an integer value to the property value>
+KEY_FUNCTIONS = {
+    "int": int,
+    "date": utils.get_datestring_for_ordinal,
+}
+
+
+class CategoryColumn(object):
+    """Integer codes for a single-valued property. None is a category like any other."""
+
+    def __init__(self, values):
+        categories = {}
+        codes = np.empty(len(values), dtype=np.int32)
+        for (i, value) in enumerate(values):
+            codes[i] = categories.setdefault(value, len(categories))
+        self.codes = codes
+        self.categories = [None] * len(categories)
+        for (value, code) in categories.items():
+            self.categories[code] = value
+        self._lookup = categories
+
+    @classmethod
+    def from_codes(cls, codes, categories):
+        """Make a column from its codes and the list of values they stand for."""
+        column = cls.__new__(cls)
+        column.codes = codes
+        column.categories = categories
+        column._lookup = dict((value, code) for (code, value) in enumerate(categories))
+        return column
+
+    def equals(self, value):
+        """Get the mask of rows with the given value."""
+        if value not in self._lookup:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == self._lookup[value]
+
+    def group(self, rows):
+        """Split the given rows by value. Returns {value: rows}."""
+        return dict((self.categories[code], group_rows)
+                    for (code, group_rows) in split_rows_by_key(self.codes[rows], rows))
+
+    def quantile_keys(self, rows):
+        """Get integer keys ordered like the rows' non-null values, plus a function to decode a key."""
+        ordered = sorted(value for value in self.categories if value is not None)
+        ranks = np.full(len(self.categories), -1, dtype=np.int64)
+        for (rank, value) in enumerate(ordered):
+            ranks[self._lookup[value]] = rank
+        keys = ranks[self.codes[rows]]
+        return (keys[keys >= 0], lambda key: ordered[key])
+
+
+class NumberColumn(object):
+    """Integer values for a property that may be None."""
+
+    def __init__(self, values, to_key=None):
+        self.null = np.fromiter((value is None for value in values), dtype=bool,
+                                count=len(values))
+        self.values = np.fromiter((0 if value is None else value for value in values),
+                                  dtype=np.int64, count=len(values))
+        self._to_key = to_key or int
+
+    @classmethod
+    def from_arrays(cls, values, null, to_key=None):
+        """Make a column from its values and null mask."""
+        column = cls.__new__(cls)
+        column.values = values
+        column.null = null
+        column._to_key = to_key or int
+        return column
+
+    def equals(self, value):
+        """Get the mask of rows with the given value."""
+        if value is None:
+            return self.null.copy()
+        return (self.values == value) & ~self.null
+
+    def group(self, rows):
+        """Split the given rows by value. Returns {value: rows}; nulls are under None."""
+        groups = {}
+        null = self.null[rows]
+        if null.any():
+            groups[None] = rows[null]
+        rows = rows[~null]
+        for (value, group_rows) in split_rows_by_key(self.values[rows], rows):
+            groups[self._to_key(value)] = group_rows
+        return groups
+
+    def quantile_keys(self, rows):
+        """Get integer keys ordered like the rows' non-null values, plus a function to decode a key."""
+        return (self.values[rows][~self.null[rows]], self._to_key)
+
+
+class MultiColumn(object):
+    """Integer codes for a property with a list of values per issue."""
+
+    def __init__(self, values):
+        categories = {}
+        self._size = len(values)
+        lengths = np.fromiter((len(row_values) for row_values in values), dtype=np.int64,
+                              count=len(values))
+        codes = np.empty(lengths.sum(), dtype=np.int32)
+        i = 0
+        for row_values in values:
+            for value in row_values:
+                codes[i] = categories.setdefault(value, len(categories))
+                i += 1
+        self.codes = codes
+        self.rows = np.repeat(np.arange(len(values)), lengths)
+        self.categories = [None] * len(categories)
+        for (value, code) in categories.items():
+            self.categories[code] = value
+        self._lookup = categories
+
+    @classmethod
+    def from_codes(cls, codes, rows, categories, size):
+        """Make a column of `size` rows from its (row, code) entries and the codes' values."""
+        column = cls.__new__(cls)
+        column._size = size
+        column.codes = codes
+        column.rows = rows
+        column.categories = categories
+        column._lookup = dict((value, code) for (code, value) in enumerate(categories))
+        return column
+
+    def equals(self, value):
+        """Get the mask of rows having the given value among their values."""
+        mask = np.zeros(self._size, dtype=bool)
+        if value in self._lookup:
+            mask[self.rows[self.codes == self._lookup[value]]] = True
+        return mask
+
+    def group(self, rows):
+        """Split the given rows by value. A row appears in the group of each of its values."""
+        entries = self._entries(rows)
+        return dict((self.categories[code], group_rows)
+                    for (code, group_rows) in split_rows_by_key(self.codes[entries],
+                                                                self.rows[entries]))
+
+    def quantile_keys(self, rows):
+        """Get integer keys ordered like every value of the rows, plus a function to decode a key."""
+        ordered = sorted(self.categories)
+        ranks = np.empty(len(self.categories), dtype=np.int64)
+        for (rank, value) in enumerate(ordered):
+            ranks[self._lookup[value]] = rank
+        return (ranks[self.codes[self._entries(rows)]], lambda key: ordered[key])
+
+    def _entries(self, rows):
+        """Get the mask of (row, value) entries belonging to the given rows."""
+        selected = np.zeros(self._size, dtype=bool)
+        selected[rows] = True
+        return selected[self.rows]
+
+
+def split_rows_by_key(keys, rows):
+    """Split rows into groups with equal keys, keeping the rows' order within a group.
+
+    Yields (key, rows) pairs.
+    """
+    order = np.argsort(keys, kind="mergesort")
+    keys = keys[order]
+    rows = rows[order]
+    (unique_keys, starts) = np.unique(keys, return_index=True)
+    ends = np.append(starts[1:], len(keys))
+    for (key, start, end) in zip(unique_keys, starts, ends):
+        yield (key, rows[start:end])
+
+
+class IssueTable(object):
+    """A set of issues stored as one NumPy array per property.
+
+    Masks are boolean arrays with one entry per issue; they can be combined
+    with & and | and passed to count, group and quantiles.
+        table = IssueTable(issues)
+        untriaged = table.equals("status", "Untriaged")
+        table.count(untriaged & ~table.launch)
+
+    Only the columns for `props` (default: all of COLUMNS) are built, in a
+    single pass over the issues. Masks from equals and groups of the whole
+    table are memoized, so displays that share a property share the work.
+    A table can also be saved to and loaded from a snapshot (see snapshot.py).
+    """
+
+    def __init__(self, issues, props=None):
+        props = list(props if props is not None else COLUMNS.keys())
+        getters = [COLUMNS[prop][1] for prop in props]
+        ids = []
+        launch = []
+        prop_values = [[] for _ in props]
+        for issue in issues:
+            ids.append(issue.id)
+            launch.append(utils.issue_is_launch_p(issue))
+            for (values, getter) in zip(prop_values, getters):
+                values.append(getter(issue))
+
+        columns = {}
+        for (prop, values) in zip(props, prop_values):
+            kind = COLUMNS[prop][0]
+            if kind == "category":
+                column = CategoryColumn(values)
+            elif kind in KEY_FUNCTIONS:
+                column = NumberColumn(values, to_key=KEY_FUNCTIONS[kind])
+            else:
+                column = MultiColumn(values)
+            columns[prop] = column
+        self._set_columns(np.array(ids, dtype=np.int64), np.array(launch, dtype=bool), columns)
+
+    @classmethod
+    def from_columns(cls, ids, launch, columns):
+        """Make a table from its id and launch arrays and {property: column}."""
+        table = cls.__new__(cls)
+        table._set_columns(ids, launch, columns)
+        return table
+
+    def _set_columns(self, ids, launch, columns):
+        """Set the arrays and columns of the table."""
+        self.ids = ids
+        self.launch = launch
+        self._columns = columns
+        self._masks = {}
+        self._groups = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def props(self):
+        """Get the properties the table has columns for."""
+        return sorted(self._columns.keys())
+
+    def column(self, prop):
+        """Get the column of the property."""
+        return self._columns[prop]
+
+    def all(self):
+        """Get a mask selecting every issue."""
+        return np.ones(len(self), dtype=bool)
+
+    def equals(self, prop, value):
+        """Get the mask of issues where the property has the value. Don't modify it.
+
+        Date values are YYYY-MM-DD strings, as returned by the date getters.
+        """
+        key = (prop, value)
+        if key not in self._masks:
+            if COLUMNS[prop][0] == "date" and value is not None:
+                (year, month, day) = value.split("-")
+                value = datetime.date(int(year), int(month), int(day)).toordinal()
+            self._masks[key] = self._columns[prop].equals(value)
+        return self._masks[key]
+
+    def count(self, mask=None):
+        """Count the issues selected by the mask."""
+        if mask is None:
+            return len(self)
+        return int(np.count_nonzero(mask))
+
+    def group(self, prop, mask=None):
+        """Group the selected issues by the property. Returns {value: array of issue ids}."""
+        if mask is None and prop in self._groups:
+            return self._groups[prop]
+        rows = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        groups = self._columns[prop].group(rows)
+        groups = dict((value, self.ids[group_rows]) for (value, group_rows) in groups.items())
+        if mask is None:
+            self._groups[prop] = groups
+        return groups
+
+    def quantiles(self, prop, quantiles, reverse=False, mask=None):
+        """Get the value at each quantile of the (non-null) property values.
+
+        Returns a list of (quantile, value) pairs. Values are ordered ascending,
+        or descending if reverse is set. The values are selected (with
+        np.partition), not fully sorted.
+        """
+        rows = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        (keys, to_value) = self._columns[prop].quantile_keys(rows)
+        return [(quantile, None if key is None else to_value(key))
+                for (quantile, key) in exact_quantiles(keys, quantiles, reverse=reverse)]
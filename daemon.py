@@ -0,0 +1,268 @@
+#!/usr/bin/python
+"""Keep a project's issues warm in memory and serve reports on them as JSON.
+
+Usage:
+  daemon.py <project> [options]
+
+Options:
+  -h --help           Show this screen.
+  --port=<PORT>       Port to listen on [default: 8081].
+  --refresh=<S>       Seconds between background refreshes [default: 300].
+  --authorize         Use logged-in client for requests.
+  --label=<LABEL>     Filter issues to the given label.
+  --concurrency=<N>   Maximum number of requests in flight [default: 10].
+  --rate=<N>          Maximum number of requests sent per second (0 for none).
+  --deadline=<S>      Give up on a page request after S seconds [default: 60].
+  --http-cache=<DIR>  Cache responses in DIR and revalidate them [default: .issues/http].
+  --cache-size=<MB>   Maximum size of the HTTP cache in megabytes [default: 200].
+  --no-http-cache     Always download pages in full, as authorized runs do.
+  --base-url=<URL>    Issue tracker to query [default: https://code.google.com].
+
+Reports take the same displays as issues.py's --display flag:
+  curl 'http://localhost:8081/report?display=count:all,groups:owner,graph:change'
+and /status describes the issues being served.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import datetime
+import json
+from SocketServer import ThreadingMixIn
+import sys
+import threading
+import time
+import traceback
+from urlparse import parse_qs, urlsplit
+
+from docopt import docopt
+
+from cache import get_default_cache
+from columns import IssueTable
+from history import IssueHistory
+import issues
+from visualizers import ChangeTracker, GridTracker
+
+HISTORY_DAYS = 120
+STEP_DAYS = 7
+
+
+def json_value(value):
+    """Convert a value (e.g. a NumPy scalar or a date) to something JSON can encode."""
+    if hasattr(value, "item"):
+        return value.item()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+class Report(object):
+    """The issues of a query, with the table and history displays are answered from.
+
+    Reports are immutable once built; the daemon swaps in a new one on
+    every refresh. Graphs are replayed from the history on first use.
+    """
+
+    def __init__(self, query, today=None):
+        today = today or datetime.date.today()
+        self.refreshed = datetime.datetime.utcnow()
+        self.start = today - datetime.timedelta(days=HISTORY_DAYS)
+        self.end = today
+        self.issues = query.fetch_all_issues()
+        self.table = IssueTable(self.issues)
+        self.history = IssueHistory.fetch(query, self.start, self.end, STEP_DAYS)
+        self._graphs = {}
+        self._graphs_lock = threading.Lock()
+
+    def count(self, arg):
+        """Get the number of issues and launches, like issues.py's count display."""
+        (num_issues, num_launches) = issues.count_issues(self.table, arg)
+        return {"issues": num_issues, "launches": num_launches}
+
+    def groups(self, prop):
+        """Get [value, number of issues] pairs, ordered like issues.py's groups display."""
+        if prop not in issues.PROPERTY_GROUPING:
+            raise ValueError("Unknown property: " + prop)
+        counts = [(json_value(value), len(ids)) for (value, ids) in self.table.group(prop).items()]
+        if issues.PROPERTY_GROUPING[prop]:
+            counts.sort(key=lambda item: item[1], reverse=True)
+        else:
+            counts.sort()
+        return counts
+
+    def quantiles(self, prop, quantiles=None):
+        """Get [quantile, value] pairs for the property."""
+        quantiles = quantiles or [99, 90, 75, 50, 25, 0]
+        return [[quantile, json_value(value)]
+                for (quantile, value) in self.table.quantiles(prop, quantiles, reverse=True)]
+
+    def graph(self, arg):
+        """Get how the issues changed over the history, by step or by a property's values."""
+        with self._graphs_lock:
+            if arg not in self._graphs:
+                self._graphs[arg] = self._replay(arg)
+            return self._graphs[arg]
+
+    def _replay(self, arg):
+        """Replay the history through a tracker for the graph."""
+        if arg == "change":
+            tracker = ChangeTracker()
+            self.history.replay(self.start, self.end, STEP_DAYS, [tracker])
+            return {"columns": ["date", "fixed", "new"],
+                    "rows": [[json_value(value) for value in row] for row in tracker.rows()]}
+        if arg not in issues.PROPERTY_FUNCTIONS:
+            raise ValueError("Unknown property: " + arg)
+        tracker = GridTracker(issues.PROPERTY_FUNCTIONS[arg][0])
+        self.history.replay(self.start, self.end, STEP_DAYS, [tracker])
+        (keys, rows) = tracker.rows()
+        return {"columns": ["date"] + [json_value(key) for key in keys],
+                "rows": [[json_value(date)] + values for (date, values) in rows]}
+
+    def display(self, display):
+        """Answer a display request, e.g. "groups:owner"."""
+        (kind, arg) = display.split(":", 1)
+        if kind == "count":
+            return self.count(arg)
+        if kind == "groups":
+            if arg == "all":
+                return dict((prop, self.groups(prop)) for prop in issues.GROUP_DEFAULTS)
+            return self.groups(arg)
+        if kind == "quantiles":
+            return self.quantiles(arg)
+        if kind == "graph":
+            return self.graph(arg)
+        raise ValueError("Unknown display: " + display)
+
+    def status(self):
+        """Describe the report."""
+        return {
+            "refreshed": self.refreshed.isoformat() + "Z",
+            "issues": len(self.issues),
+            "history": [self.start.isoformat(), self.end.isoformat()],
+        }
+
+
+class ReportDaemon(object):
+    """Keep a Report for the query, rebuilding it every `refresh` seconds in the background.
+
+    Requests are answered from the current report while the next one is built.
+    """
+
+    def __init__(self, query, refresh):
+        self._query = query
+        self._refresh = refresh
+        self._report = None
+        self._last_error = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @property
+    def report(self):
+        """Get the current Report."""
+        return self._report
+
+    def refresh(self):
+        """Rebuild the report from fresh pages."""
+        get_default_cache().clear()
+        start = time.time()
+        report = Report(self._query)
+        self._report = report
+        print >> sys.stderr, "Refreshed {n} issues in {secs:.1f}s".format(
+            n=len(report.issues), secs=time.time() - start)
+
+    def start(self):
+        """Build the first report, then keep refreshing it in the background."""
+        self.refresh()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        """Refresh on schedule until stopped. A failed refresh keeps the previous report."""
+        while not self._stopped.wait(self._refresh):
+            try:
+                self.refresh()
+                self._last_error = None
+            except Exception:
+                self._last_error = traceback.format_exc()
+                print >> sys.stderr, self._last_error
+
+    def stop(self):
+        """Stop refreshing."""
+        self._stopped.set()
+
+    def status(self):
+        """Describe the daemon and its current report."""
+        status = self._report.status()
+        status["refresh_seconds"] = self._refresh
+        status["last_error"] = self._last_error
+        return status
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    """Answer /report and /status requests from the server's ReportDaemon."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        """Serve a report or the status."""
+        (_, _, path, query_string, _) = urlsplit(self.path)
+        daemon = self.server.daemon
+        if path == "/status":
+            return self._send(200, daemon.status())
+        if path != "/report":
+            return self._send(404, {"error": "Not found"})
+
+        params = parse_qs(query_string)
+        displays = ",".join(params.get("display", [])).split(",")
+        report = daemon.report
+        result = {"refreshed": report.status()["refreshed"], "displays": {}}
+        for display in displays:
+            if display == "":
+                continue
+            try:
+                result["displays"][display] = report.display(display)
+            except (ValueError, KeyError) as e:
+                return self._send(400, {"error": "{display}: {error}".format(display=display,
+                                                                           error=e)})
+        self._send(200, result)
+
+    def _send(self, status, value):
+        """Send a JSON response."""
+        body = json.dumps(value)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ReportServer(ThreadingMixIn, HTTPServer):
+    """A threaded HTTP server for a ReportDaemon."""
+
+    daemon_threads = True
+
+    def __init__(self, address, daemon):
+        HTTPServer.__init__(self, address, ReportHandler)
+        self.daemon = daemon
+
+
+def main():
+    """Serve reports until interrupted."""
+    arguments = docopt(__doc__)
+    fetcher = issues.create_fetcher(arguments)
+    query = issues.create_query(arguments, fetcher)
+
+    daemon = ReportDaemon(query, refresh=float(arguments["--refresh"]))
+    daemon.start()
+    server = ReportServer(("127.0.0.1", int(arguments["--port"])), daemon)
+    print >> sys.stderr, "Serving reports on http://127.0.0.1:{port}/report".format(
+        port=server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+
+if __name__ == "__main__":
+    main()
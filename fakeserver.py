@@ -0,0 +1,254 @@
+#!/usr/bin/python
+"""Local stand-in for the Project Hosting issues feed, for end-to-end load tests.
+
+Usage:
+  fakeserver.py [options]
+
+Options:
+  -h --help             Show this screen.
+  --port=<PORT>         Port to listen on [default: 8080].
+  --issues=<N>          Number of synthetic issues per project [default: 10000].
+  --seed=<SEED>         Seed for the synthetic issues [default: 0].
+  --latency=<MS>        Base latency added to each response [default: 0].
+  --jitter=<MS>         Maximum random extra latency [default: 0].
+  --rate=<RPS>          Requests per second before throttling with 503s (0 for none) [default: 0].
+  --error-rate=<FRAC>   Fraction of requests that fail with a 500 [default: 0].
+  --max-results=<N>     Largest page size served [default: 1000].
+  --max-offset=<N>      Reject pages starting past N results (0 for no limit) [default: 0].
+  --seek-latency=<MS>   Extra latency per 1000 results skipped to reach a page [default: 0].
+
+Serves /feeds/issues/p/<project>/issues/full for any project, supporting
+start-index/max-results paging, can=open|all, label=, updated-min= and the
+opened-/closed-before/after search operators in q=. Pages carry an ETag
+(If-None-Match gets a 304) and are gzipped if asked. Point issues.py at it with
+  ./issues.py myproject --base-url=http://localhost:8080
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from cStringIO import StringIO
+import datetime
+import gzip
+import hashlib
+import random
+import re
+from SocketServer import ThreadingMixIn
+import threading
+import time
+from urllib import urlencode
+from urlparse import parse_qsl, urlsplit
+
+from docopt import docopt
+
+from query import IssuesQuery
+import synthetic
+from utils import Issue
+
+MAX_SEARCHES = 256  # searches whose matches are kept, so paging through one doesn't redo it
+FEED_PATH_RE = re.compile(r"^/feeds/issues/p/(?P<project>[^/]+)/issues/full$")
+
+
+class FeedConfig(object):
+    """How the fake feed behaves."""
+
+    def __init__(self, latency=0.0, jitter=0.0, rate=0.0, error_rate=0.0, max_results=1000,
+                 max_offset=0, offset_latency=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.error_rate = error_rate
+        self.max_results = max_results
+        self.max_offset = max_offset
+        self.offset_latency = offset_latency
+
+
+class FakeFeed(object):
+    """Synthetic issues with their pre-rendered feed entries."""
+
+    def __init__(self, num_issues, seed=0, today=None):
+        synthetic_issues = synthetic.generate_issues(num_issues, seed=seed,
+                                                     today=today or datetime.date.today())
+        self.entries = [synthetic.render_entry(issue) for issue in synthetic_issues]
+        self.issues = [
+            Issue(issue.id, owner=issue.owner, status=issue.status, state=issue.state,
+                  stars=issue.stars, published=issue.published.toordinal(),
+                  updated=issue.updated.toordinal(),
+                  closed=issue.closed.toordinal() if issue.closed else None,
+                  labels=issue.labels)
+            for issue in synthetic_issues]
+        self._searches = {}
+        self._searches_lock = threading.Lock()
+
+    def search(self, project, params):
+        """Get the indexes of the issues matching the feed params, or None if unsupported."""
+        key = (project, tuple(sorted((name, value) for (name, value) in params.items()
+                                     if name not in ("start-index", "max-results"))))
+        with self._searches_lock:
+            if key in self._searches:
+                return self._searches[key]
+        matches = self._search(project, params)
+        with self._searches_lock:
+            if len(self._searches) >= MAX_SEARCHES:
+                self._searches.clear()
+            self._searches[key] = matches
+        return matches
+
+    def _search(self, project, params):
+        """Find the issues matching the feed params, or None if unsupported."""
+        params = dict(params)
+        updated_min = params.pop("updated-min", None)
+        label = params.pop("label", None)
+        feed_params = {"can": params.get("can", "open")}
+        query = IssuesQuery(project, params=feed_params, query=params.get("q"))
+        pred = query.local_predicate()
+        if pred is None:
+            return None
+        if updated_min is not None:
+            (year, month, day) = [int(part) for part in updated_min[:10].split("-")]
+            updated = datetime.date(year, month, day).toordinal()
+        matches = []
+        for (i, issue) in enumerate(self.issues):
+            if label is not None and label not in issue.labels:
+                continue
+            if updated_min is not None and issue.updated < updated:
+                continue
+            if pred(issue):
+                matches.append(i)
+        return matches
+
+
+class Throttle(object):
+    """Allow at most `rate` requests in any one-second window."""
+
+    def __init__(self, rate):
+        self._rate = rate
+        self._window = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Test whether another request is allowed now."""
+        if self._rate <= 0:
+            return True
+        with self._lock:
+            window = int(time.time())
+            if window != self._window:
+                self._window = window
+                self._count = 0
+            self._count += 1
+            return self._count <= self._rate
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    """Answer feed requests from the server's FakeFeed."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        """Serve a page of the feed."""
+        server = self.server
+        config = server.config
+        (_, _, path, query_string, _) = urlsplit(self.path)
+        match = FEED_PATH_RE.match(path)
+        if match is None:
+            return self._send(404, "Not found")
+
+        delay = config.latency + random.uniform(0, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if not server.throttle.allow():
+            return self._send(503, "Rate limited", {"Retry-After": "1"})
+        if random.random() < config.error_rate:
+            return self._send(500, "Injected error")
+
+        params = dict(parse_qsl(query_string))
+        matches = server.feed.search(match.group("project"), params)
+        if matches is None:
+            return self._send(400, "Unsupported query")
+        start = max(int(params.pop("start-index", 1)), 1) - 1
+        limit = min(int(params.pop("max-results", 25)), config.max_results)
+        if config.max_offset > 0 and start > config.max_offset:
+            return self._send(400, "start-index is too large")
+        if config.offset_latency > 0:
+            # Deep pages are slow to reach, as on a real database
+            time.sleep(config.offset_latency * start / 1000.0)
+
+        next_url = None
+        if start + limit < len(matches):
+            params["start-index"] = start + limit + 1
+            params["max-results"] = limit
+            next_url = "http://{host}{path}?{query}".format(
+                host=self.headers.get("Host", "localhost"), path=path, query=urlencode(params))
+        entries = [server.feed.entries[i] for i in matches[start:start + limit]]
+        body = synthetic.render_feed_entries(entries, len(matches), next_url)
+        etag = '"{digest}"'.format(digest=hashlib.md5(body).hexdigest())
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(304, "", {"ETag": etag})
+        headers = {"Content-Type": "application/atom+xml; charset=UTF-8", "ETag": etag}
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip_compress(body)
+            headers["Content-Encoding"] = "gzip"
+        self._send(200, body, headers)
+
+    def _send(self, status, body, headers=None):
+        """Send a complete response."""
+        self.send_response(status)
+        for (key, value) in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def gzip_compress(body):
+    """Compress the body with gzip."""
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as f:
+        f.write(body)
+    return buf.getvalue()
+
+
+class FakeFeedServer(ThreadingMixIn, HTTPServer):
+    """A threaded HTTP server for a FakeFeed."""
+
+    daemon_threads = True
+
+    def __init__(self, address, feed, config):
+        HTTPServer.__init__(self, address, FeedHandler)
+        self.feed = feed
+        self.config = config
+        self.throttle = Throttle(config.rate)
+
+    @property
+    def base_url(self):
+        """Get the base URL to give IssuesQuery."""
+        return "http://{host}:{port}".format(host=self.server_address[0],
+                                             port=self.server_address[1])
+
+def start_server(feed, config=None, port=0):
+    """Start a FakeFeedServer on a background thread. Port 0 picks a free port."""
+    server = FakeFeedServer(("127.0.0.1", port), feed, config or FeedConfig())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def main():
+    """Run the fake feed server."""
+    arguments = docopt(__doc__)
+    config = FeedConfig(latency=float(arguments["--latency"]) / 1000,
+                        jitter=float(arguments["--jitter"]) / 1000,
+                        rate=float(arguments["--rate"]),
+                        error_rate=float(arguments["--error-rate"]),
+                        max_results=int(arguments["--max-results"]),
+                        max_offset=int(arguments["--max-offset"]),
+                        offset_latency=float(arguments["--seek-latency"]) / 1000)
+    feed = FakeFeed(int(arguments["--issues"]), seed=int(arguments["--seed"]))
+    server = FakeFeedServer(("127.0.0.1", int(arguments["--port"])), feed, config)
+    print "Serving {num} issues at {url}".format(num=len(feed.issues), url=server.base_url)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Shared engine for fetching feed pages concurrently over pooled http connections."""
+
+from contextlib import contextmanager
+from functools import partial
+import Queue
+import sys
+import threading
+
+from auth import authorization_headers
+from metrics import FetchMetrics
+import profiling
+from scheduler import RequestScheduler
+
+DEFAULT_CONCURRENCY = 10
+
+
+class ClientPool(object):
+    """A bounded pool of http clients.
+
+    Clients are reused between requests so that their keep-alive connections
+    (one per host) are too. At most `size` clients are ever created.
+    """
+
+    def __init__(self, factory, size):
+        self._factory = factory
+        self._idle = Queue.LifoQueue()
+        self._available = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def client(self):
+        """Check out a client for the duration of the block."""
+        self._available.acquire()
+        try:
+            try:
+                client = self._idle.get_nowait()
+            except Queue.Empty:
+                client = self._factory()
+            try:
+                yield client
+            finally:
+                self._idle.put(client)
+        finally:
+            self._available.release()
+
+
+class Fetcher(object):
+    """Run feed requests on a shared pool of worker threads.
+
+    A single Fetcher is meant to be shared by every query in a run, so worker
+    threads and connections are set up once. `concurrency` caps both the
+    number of worker threads and the number of open clients. If given a
+    CredentialManager, every request carries its bearer token. Requests go
+    through a RequestScheduler, which rate limits, retries, hedges and times
+    them out. Request and worker activity is recorded in `metrics` (a
+    FetchMetrics).
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, client_factory=None, credentials=None,
+                 scheduler=None):
+        if concurrency < 1:
+            raise ValueError("The concurrency must be at least 1")
+        if scheduler is None:
+            scheduler = RequestScheduler()
+        if client_factory is None:
+            import httplib2
+            # Don't let an abandoned attempt hold its client much past the deadline
+            client_factory = partial(httplib2.Http, timeout=scheduler.deadline)
+        self._concurrency = concurrency
+        self._scheduler = scheduler
+        # Hedged attempts need clients on top of the ones the workers use
+        self._clients = ClientPool(client_factory, concurrency + scheduler.max_hedges)
+        self._credentials = credentials
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()
+        self._metrics = FetchMetrics(concurrency)
+
+    @property
+    def concurrency(self):
+        """Get the maximum number of requests in flight."""
+        return self._concurrency
+
+    @property
+    def metrics(self):
+        """Get the FetchMetrics for requests made by this fetcher."""
+        return self._metrics
+
+    def request(self, url):
+        """GET the url and return the content. Raises scheduler.RequestError if it fails."""
+        (_, content) = self._scheduler.run(partial(self._attempt, url), self._metrics)
+        return content
+
+    def _attempt(self, url):
+        """Make one attempt at the request using a pooled client. Returns (response, content)."""
+        with self._clients.client() as client:
+            token = self._token()
+            with profiling.phase("network"):
+                (response, content) = self._send(client, url, token)
+            if response.status == 401 and token is not None:
+                # The token was revoked or expired early; refresh it (unless another
+                # worker already has) and try once more.
+                self._metrics.request_retried()
+                token = self._token(stale_token=token)
+                with profiling.phase("network"):
+                    (response, content) = self._send(client, url, token)
+        return (response, content)
+
+    def _send(self, client, url, token):
+        """Send one GET request with the access token (if any), recording it in the metrics."""
+        headers = authorization_headers(token) if token is not None else None
+        started = self._metrics.request_started()
+        try:
+            (response, content) = client.request(url, "GET", headers=headers)
+        except Exception:
+            self._metrics.request_finished(started)
+            raise
+        (status, transferred) = (response.status, len(content))
+        exchange = getattr(client, "last_exchange", None)
+        if exchange is not None:
+            # What the server sent, e.g. a 304 or a gzipped page (see httpcache.CachingHttp)
+            (status, transferred) = exchange
+        elif getattr(response, "fromcache", False):
+            transferred = 0
+        self._metrics.request_finished(started, status, len(content), transferred)
+        return (response, content)
+
+    def _token(self, stale_token=None):
+        """Get the access token to send, or None if requests aren't authorized."""
+        if self._credentials is None:
+            return None
+        return self._credentials.access_token(stale_token=stale_token)
+
+    def _get_pool(self):
+        """Get the worker pool, starting it on first use."""
+        with self._pool_lock:
+            if self._pool is None:
+                # Imported here, as multiprocessing is slow to import and runs
+                # served from the store never need the pool
+                from multiprocessing.pool import ThreadPool
+                self._pool = ThreadPool(self._concurrency)
+            return self._pool
+
+    def _run_in_worker(self, fn):
+        """Wrap fn so that calls to map from inside a worker run inline."""
+        def run(item):
+            """Call fn on the item, marking the thread as a worker."""
+            self._local.in_worker = True
+            started = self._metrics.worker_started()
+            try:
+                return profiling.profile_task(fn, item)
+            finally:
+                self._metrics.worker_finished(started)
+        return run
+
+    def map(self, fn, items):
+        """Call fn on each item using the worker threads. Results are in order.
+
+        Calls made from a worker thread run inline, since waiting on the
+        shared pool from inside it could deadlock.
+        """
+        items = list(items)
+        if getattr(self._local, "in_worker", False) or len(items) <= 1:
+            return map(fn, items)
+        return self._get_pool().map(self._run_in_worker(fn), items)
+
+    def stream(self, fn, items, max_pending=None):
+        """Call fn on each item using the worker threads, yielding (item, result) as calls finish.
+
+        At most `max_pending` calls (default: the concurrency) are in flight or
+        waiting to be consumed at once. New calls are only started as results
+        are taken, so a slow consumer holds back the requests rather than
+        letting finished pages pile up. Exceptions are re-raised when the
+        failed call's result is taken.
+        """
+        if getattr(self._local, "in_worker", False):
+            for item in items:
+                yield (item, fn(item))
+            return
+
+        max_pending = max_pending or self._concurrency
+        pool = self._get_pool()
+        done = Queue.Queue()
+        run = self._run_in_worker(fn)
+
+        def call(item):
+            """Run fn on the item and hand the outcome to the consumer."""
+            try:
+                done.put((item, run(item), None))
+            except Exception:
+                done.put((item, None, sys.exc_info()))
+
+        def take():
+            """Wait for the next finished call."""
+            (item, result, exc_info) = done.get()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            return (item, result)
+
+        pending = 0
+        for item in items:
+            while pending >= max_pending:
+                pending -= 1
+                yield take()
+            pool.apply_async(call, (item,))
+            pending += 1
+        while pending > 0:
+            pending -= 1
+            yield take()
+
+    def close(self):
+        """Stop the worker threads."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+
+
+_default_fetcher = None
+_default_fetcher_lock = threading.Lock()
+
+def get_default_fetcher():
+    """Get the Fetcher shared by queries that weren't given one."""
+    global _default_fetcher
+    with _default_fetcher_lock:
+        if _default_fetcher is None:
+            _default_fetcher = Fetcher()
+        return _default_fetcher
+
+def set_default_fetcher(fetcher):
+    """Set the Fetcher shared by queries that weren't given one."""
+    global _default_fetcher
+    with _default_fetcher_lock:
+        _default_fetcher = fetcher
@@ -0,0 +1,99 @@
+"""Replay how a query's issues changed over time from a single fetch."""
+
+from bisect import bisect_left
+import datetime
+
+from query import fetch_all
+import utils
+
+
+def closed_ordinal(issue):
+    """Get the day ordinal the issue was closed on, or None if it is open."""
+    if utils.issue_is_open_p(issue):
+        return None
+    return issue.closed
+
+
+def step_dates(start, end, days):
+    """Get the (start, end) dates of each `days`-long step starting before `end`."""
+    steps = []
+    date = start
+    while date < end:
+        end_date = date + datetime.timedelta(days=days)
+        steps.append((date, end_date))
+        date = end_date
+    return steps
+
+
+class IssueHistory(object):
+    """Every issue that was open at some point in a date window.
+
+    The issues are kept as two event streams, sorted by the day they were
+    opened and closed, so the issues open on any date and the changes over
+    any step size within the window can be computed without more fetches.
+        history = IssueHistory.fetch(query, start, end, 7)
+        history.replay(start, end, 7, [ChangeTracker(), GridTracker(get_issue_priority)])
+    """
+
+    def __init__(self, issues):
+        issues = dict((issue.id, issue) for issue in issues).values()
+        opened = [issue for issue in issues if issue.published is not None]
+        opened.sort(key=lambda issue: issue.published)
+        closed = [issue for issue in issues if closed_ordinal(issue) is not None]
+        closed.sort(key=closed_ordinal)
+        self._opened = opened
+        self._opened_keys = [issue.published for issue in opened]
+        self._closed = closed
+        self._closed_keys = [closed_ordinal(issue) for issue in closed]
+
+    @classmethod
+    def fetch(cls, query, start, end, days):
+        """Fetch the history of the query's issues for `days`-long steps from start to end.
+
+        Two queries are made, in parallel: issues still open that were opened
+        before the end of the last step, and closed issues opened before then
+        but closed after `start`.
+        """
+        steps = step_dates(start, end, days)
+        window_end = steps[-1][1] if steps else end
+        queries = [query.opened_before(window_end),
+                   query.can("all").opened_before(window_end).closed_after(start)]
+        (open_issues, closed_issues) = fetch_all(queries)
+        return cls(open_issues + closed_issues)
+
+    def opened_in_range(self, start, end):
+        """Get the issues opened from midnight starting `start` up to midnight starting `end`."""
+        return self._opened[bisect_left(self._opened_keys, start.toordinal()):
+                            bisect_left(self._opened_keys, end.toordinal())]
+
+    def closed_in_range(self, start, end):
+        """Get the issues closed from midnight starting `start` up to midnight starting `end`."""
+        return self._closed[bisect_left(self._closed_keys, start.toordinal()):
+                            bisect_left(self._closed_keys, end.toordinal())]
+
+    def open_on_date(self, date):
+        """Get the issues that were open at midnight starting the given date."""
+        ordinal = date.toordinal()
+        opened = self._opened[:bisect_left(self._opened_keys, ordinal)]
+        return [issue for issue in opened
+                if closed_ordinal(issue) is None or closed_ordinal(issue) >= ordinal]
+
+    def changes_for_range(self, start, end, days):
+        """Get the issues opened and closed in each `days`-long step from start to end.
+
+        Returns a list of (step start date, opened issues, closed issues). The
+        last step runs its full length, past `end`, so issues opened or closed
+        on `end` itself are included.
+        """
+        return [(date, self.opened_in_range(date, end_date), self.closed_in_range(date, end_date))
+                for (date, end_date) in step_dates(start, end, days)]
+
+    def replay(self, start, end, days, trackers):
+        """Feed the trackers the issues open at `start`, then each step's changes."""
+        start_issues = self.open_on_date(start)
+        for tracker in trackers:
+            tracker.start(start, start_issues)
+
+        for (date, opened_issues, closed_issues) in self.changes_for_range(start, end, days):
+            for tracker in trackers:
+                tracker.step(date, opened_issues, closed_issues)
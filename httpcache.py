@@ -0,0 +1,159 @@
+"""HTTP clients that revalidate pages against a bounded on-disk cache.
+
+httplib2 does the HTTP caching: it asks for gzip/deflate encoded pages,
+stores responses in the cache, and revalidates stale ones with their
+ETag/Last-Modified, so that unchanged pages come back as small 304s.
+Responses are stored as they were received, so only public pages should
+be cached.
+    cache = BoundedFileCache(".issues/http")
+    client = CachingHttp(cache)
+"""
+
+import os
+import tempfile
+import threading
+
+import httplib2
+
+DEFAULT_CACHE_DIR = ".issues/http"
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+TEMP_PREFIX = ".tmp"
+
+
+class BoundedFileCache(httplib2.FileCache):
+    """An httplib2 FileCache that keeps at most `max_bytes` of responses.
+
+    Unlike FileCache, it is safe to share between threads: files are written
+    atomically, and the least recently used ones are removed once the cache
+    is over its size.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        httplib2.FileCache.__init__(self, directory)
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._used = {}  # <file name>: [<last used>, <size>]
+        self._tick = 0
+        files = [(os.path.getmtime(os.path.join(directory, name)), name)
+                 for name in os.listdir(directory) if not name.startswith(TEMP_PREFIX)]
+        for (_, name) in sorted(files):
+            self._touch(name, os.path.getsize(os.path.join(directory, name)))
+
+    def _touch(self, name, size=None):
+        """Mark the file as just used, updating its size if given."""
+        self._tick += 1
+        if size is None:
+            size = self._used[name][1]
+        self._used[name] = [self._tick, size]
+
+    @property
+    def size(self):
+        """Get the number of bytes in the cache."""
+        with self._lock:
+            return sum(size for (_, size) in self._used.values())
+
+    def get(self, key):
+        name = self.safe(key)
+        value = httplib2.FileCache.get(self, key)
+        with self._lock:
+            if value is not None and name in self._used:
+                self._touch(name)
+        return value
+
+    def set(self, key, value):
+        name = self.safe(key)
+        (fd, temp_path) = tempfile.mkstemp(dir=self.cache, prefix=TEMP_PREFIX)
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        with self._lock:
+            os.rename(temp_path, os.path.join(self.cache, name))
+            self._touch(name, len(value))
+            self._evict()
+
+    def delete(self, key):
+        name = self.safe(key)
+        with self._lock:
+            self._remove(name)
+
+    def _remove(self, name):
+        """Remove the file, if it's there."""
+        self._used.pop(name, None)
+        try:
+            os.remove(os.path.join(self.cache, name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Remove the least recently used files until the cache fits in its size."""
+        total = sum(size for (_, size) in self._used.values())
+        if total <= self._max_bytes:
+            return
+        for (name, (_, size)) in sorted(self._used.items(), key=lambda item: item[1][0]):
+            if total <= self._max_bytes:
+                break
+            self._remove(name)
+            total -= size
+
+
+def _wire_size(response):
+    """Get (status, Content-Length or None) of an httplib response, as sent."""
+    length = response.getheader("content-length")
+    return (response.status, int(length) if length is not None else None)
+
+
+class _CountingHTTPConnection(httplib2.HTTPConnectionWithTimeout):
+    """An http connection that notes the status and size of each response."""
+
+    last_response = None
+
+    def getresponse(self, *args, **kwargs):
+        response = httplib2.HTTPConnectionWithTimeout.getresponse(self, *args, **kwargs)
+        self.last_response = _wire_size(response)
+        return response
+
+
+class _CountingHTTPSConnection(httplib2.HTTPSConnectionWithTimeout):
+    """An https connection that notes the status and size of each response."""
+
+    last_response = None
+
+    def getresponse(self, *args, **kwargs):
+        response = httplib2.HTTPSConnectionWithTimeout.getresponse(self, *args, **kwargs)
+        self.last_response = _wire_size(response)
+        return response
+
+
+COUNTING_CONNECTIONS = {
+    "http": _CountingHTTPConnection,
+    "https": _CountingHTTPSConnection,
+}
+
+
+class CachingHttp(httplib2.Http):
+    """An httplib2.Http that notes what went over the wire for its last request.
+
+    After each request, `last_exchange` is (status, bytes) of the response
+    the server actually sent, before decompression: e.g. (304, 0) for a page
+    revalidated from the cache. It is None if the request was answered from
+    the cache without contacting the server.
+    """
+
+    def __init__(self, cache=None, **kwargs):
+        httplib2.Http.__init__(self, cache=cache, **kwargs)
+        self.last_exchange = None
+
+    def request(self, uri, method="GET", body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        self.last_exchange = None
+        if connection_type is None:
+            scheme = uri.split(":", 1)[0].lower()
+            connection_type = COUNTING_CONNECTIONS.get(scheme)
+        return httplib2.Http.request(self, uri, method, body, headers, redirections,
+                                     connection_type)
+
+    def _conn_request(self, conn, request_uri, method, body, headers):
+        (response, content) = httplib2.Http._conn_request(self, conn, request_uri, method,
+                                                          body, headers)
+        (status, length) = getattr(conn, "last_response", None) or (response.status, None)
+        self.last_exchange = (status, length if length is not None else len(content))
+        return (response, content)
@@ -0,0 +1,91 @@
+"""Compact sets of issue ids."""
+
+# Number of bits set in each byte value
+POPCOUNT = bytearray(bin(i).count("1") for i in range(256))
+
+
+class IdSet(object):
+    """A set of non-negative integer ids, stored as a bitmap.
+
+    Issue ids are dense, so a bitmap takes one bit per id up to the largest
+    id in the set. All updates happen in place; the size is tracked as ids
+    are added and removed, so len() is O(1).
+        ids = IdSet([1, 5, 9])
+        ids.add(12)
+        ids.intersection_update(IdSet([5, 12, 40]))
+        len(ids)  # 2
+    """
+
+    __slots__ = ("_bits", "_count")
+
+    def __init__(self, ids=()):
+        self._bits = bytearray()
+        self._count = 0
+        self.update(ids)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, issue_id):
+        byte = issue_id >> 3
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << (issue_id & 7)))
+
+    def __iter__(self):
+        for (byte, value) in enumerate(self._bits):
+            if value:
+                for bit in range(8):
+                    if value & (1 << bit):
+                        yield (byte << 3) | bit
+
+    def __repr__(self):
+        return "IdSet({ids})".format(ids=list(self))
+
+    def add(self, issue_id):
+        """Add an id to the set."""
+        byte = issue_id >> 3
+        if byte >= len(self._bits):
+            # Grow geometrically so adding increasing ids is amortized O(1)
+            self._bits.extend(bytearray(max(byte + 1 - len(self._bits), len(self._bits))))
+        mask = 1 << (issue_id & 7)
+        if not self._bits[byte] & mask:
+            self._bits[byte] |= mask
+            self._count += 1
+
+    def discard(self, issue_id):
+        """Remove an id from the set if it is present."""
+        byte = issue_id >> 3
+        mask = 1 << (issue_id & 7)
+        if byte < len(self._bits) and self._bits[byte] & mask:
+            self._bits[byte] &= ~mask & 0xFF
+            self._count -= 1
+
+    def update(self, ids):
+        """Add each of the ids to the set."""
+        for issue_id in ids:
+            self.add(issue_id)
+
+    def difference_update(self, ids):
+        """Remove each of the ids from the set."""
+        for issue_id in ids:
+            self.discard(issue_id)
+
+    def intersection_update(self, other):
+        """Keep only the ids that are also in the other IdSet."""
+        bits = self._bits
+        other_bits = other._bits
+        del bits[len(other_bits):]
+        for byte in range(len(bits)):
+            if bits[byte]:
+                bits[byte] &= other_bits[byte]
+        self._count = sum(bits.translate(POPCOUNT))
+
+    def intersection_count(self, other):
+        """Count the ids in both this and the other IdSet, without building the intersection."""
+        return sum(POPCOUNT[a & b] for (a, b) in zip(self._bits, other._bits) if a and b)
+
+    def copy(self):
+        """Get a copy of the set."""
+        copy = IdSet()
+        copy._bits = bytearray(self._bits)
+        copy._count = self._count
+        return copy
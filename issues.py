@@ -5,11 +5,26 @@ Usage:
   issues.py <project> [options]
 
 Options:
-  -h --help         Show this screen.
-  --version         Show version.
-  --authorize       Use logged-in client for requests.
-  --label=<LABEL>   Filter issues to the given label.
-  --display=<LIST>  Comma-separate list of things to show.
+  -h --help           Show this screen.
+  --version           Show version.
+  --authorize         Use logged-in client for requests.
+  --label=<LABEL>     Filter issues to the given label.
+  --concurrency=<N>   Maximum number of requests in flight [default: 10].
+  --rate=<N>          Maximum number of requests sent per second (0 for none).
+  --deadline=<S>      Give up on a page request after S seconds [default: 60].
+  --http-cache=<DIR>  Cache responses in DIR and revalidate them [default: .issues/http].
+  --cache-size=<MB>   Maximum size of the HTTP cache in megabytes [default: 200].
+  --no-http-cache     Always download pages in full, as authorized runs do.
+  --base-url=<URL>    Issue tracker to query [default: https://code.google.com].
+  --display=<LIST>    Comma-separate list of things to show.
+  --sync              Sync the local issue store, then display from it.
+  --store             Display from the local issue store without syncing.
+  --shard             Fetch all issues in parallel windows of the dates they were opened.
+  --profile=<FILE>    Time each phase and display (plus cProfile) and write a JSON summary.
+  --metrics=<FILE>    Write request metrics to FILE (JSON if it ends in .json, else Prometheus).
+  --snapshot=<FILE>   Write a binary snapshot of the fetched issues to FILE.
+  --load=<FILE>       Display counts, groups and quantiles from a snapshot instead of fetching.
+  --sketch=<ERR>      Estimate quantiles to within ERR of their rank from streamed pages.
 
 You can control what information is display using the --display flag.
 * "count:all" -- print count for all matching issues
@@ -24,61 +39,23 @@ You can control what information is display using the --display flag.
 "stars", "updated", "published", "label"
 """
 
-import argparse
 import datetime
 from docopt import docopt
-import httplib2
-from oauth2client import tools
-from oauth2client.client import flow_from_clientsecrets
-from oauth2client.file import Storage
-from oauth2client.tools import run_flow
 from functools import partial
-
+import sys
+import timeit
+
+from auth import CredentialManager
+from cache import get_default_cache
+from fetcher import Fetcher, set_default_fetcher
+from history import IssueHistory
+import profiling
 from query import IssuesQuery
+from scheduler import RequestScheduler
+from store import IssueStore
 import utils
-from visualizers import ChangeTracker, GridTracker, print_groups_by_prop, \
-    print_groups_by_list_prop, print_quantiles
-
-CLIENT_SECRETS = 'client_secrets.json'
-OAUTH2_STORAGE = 'oauth2.dat'
-ISSUE_TRACKER_SCOPE = 'https://code.google.com/feeds/issues'
-
+from visualizers import ChangeTracker, GridTracker, print_groups, print_quantile_values
 
-def _authorize():
-    """Return authenticated http client.
-
-    _authorize will try to read credentials from OAUTH2_STORAGE. If
-    credentials do not exist, _authorize will open a sign-in flow. The
-    authorized http client will have access to the scope ISSUE_TRACKER_SCOPE,
-    and will read oauth tokens from CLIENT_SECRETS.
-    """
-    parser = argparse.ArgumentParser(
-        description=__doc__,
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        parents=[tools.argparser])
-    flags = parser.parse_args([])
-
-    # Perform OAuth 2.0 authorization.
-    flow = flow_from_clientsecrets(CLIENT_SECRETS, scope=ISSUE_TRACKER_SCOPE)
-    storage = Storage(OAUTH2_STORAGE)
-    credentials = storage.get()
-
-    if credentials is None or credentials.invalid:
-        credentials = run_flow(flow, storage, flags)
-    http = httplib2.Http()
-    auth_http = credentials.authorize(http)
-    return auth_http
-
-def get_issues_open_on_date(query, date):
-    """Get the issues that were open on the given date."""
-    issues = []
-    # Closed bugs that were filed before `date` and closed after `date`
-    closed_bugs_query = query.can("all").opened_before(date).closed_after(date)
-    issues += closed_bugs_query.fetch_all_issues(authorize=_authorize)
-    # Open bugs that were filed before `date`
-    open_bugs_query = query.opened_before(date)
-    issues += open_bugs_query.fetch_all_issues(authorize=_authorize)
-    return issues
 
 def iterate_through_issue_range(query, start, end, days, trackers):
     """Iterate through the range.
@@ -93,17 +70,13 @@ def iterate_through_issue_range(query, start, end, days, trackers):
     - end: the end of the time period (date.date)
     - days: the number of days to include in each interval
     - trackers: a list of HistoryTracker objects
-    """
-    date = start
-    start_issues = get_issues_open_on_date(query, date)
-
-    for tracker in trackers:
-        tracker.start(date, start_issues)
 
-    changes = query.fetch_changes_for_range(start, end, days, authorize=_authorize)
-    for (date, opened_issues, closed_issues) in changes:
-        for tracker in trackers:
-            tracker.step(date, opened_issues, closed_issues)
+    The whole range is fetched at once (see IssueHistory) and replayed locally.
+    """
+    with profiling.phase("history:fetch"):
+        history = IssueHistory.fetch(query, start, end, days)
+    with profiling.phase("history:replay"):
+        history.replay(start, end, days, trackers)
 
 
 PROPERTY_FUNCTIONS = {
@@ -119,16 +92,16 @@ PROPERTY_FUNCTIONS = {
     "label": (partial(utils.get_issue_labels_by_prefix, "Cr-"), list)
 }
 PROPERTY_GROUPING = {
-    # <name>: (<printer function>, <sort by number of issues instead of property>)
-    "owner": (print_groups_by_prop, True),
-    "priority": (print_groups_by_prop, False),
-    "milestone": (print_groups_by_prop, False),
-    "status": (print_groups_by_prop, True),
-    "type": (print_groups_by_prop, True),
-    "stars": (print_groups_by_prop, False),
-    "updated": (print_groups_by_prop, False),
-    "published": (print_groups_by_prop, False),
-    "label": (print_groups_by_list_prop, True),
+    # <name>: <sort by number of issues instead of property>
+    "owner": True,
+    "priority": False,
+    "milestone": False,
+    "status": True,
+    "type": True,
+    "stars": False,
+    "updated": False,
+    "published": False,
+    "label": True,
 }
 GROUP_DEFAULTS = ["owner", "priority", "milestone", "status", "type", "stars", "updated",
                   "published", "label"]
@@ -146,58 +119,77 @@ def value_for_arg(arg, tipe, none_allowed=True):
         return None
     return tipe(arg)
 
-def create_pred_from_arg(arg):
-    """Create a predicate based on an argument. Must be of the form propertyname=value."""
+def parse_prop_arg(arg):
+    """Parse an argument of the form propertyname=value. Returns (prop, value)."""
     (prop, value) = arg.split("=")
-    (prop_fn, tipe) = PROPERTY_FUNCTIONS[prop]
-    value = value_for_arg(value, tipe)
-    return utils.issue_property_matches_p(prop_fn, value)
+    (_, tipe) = PROPERTY_FUNCTIONS[prop]
+    if tipe is list:
+        # List properties match if any one of their values does
+        tipe = str
+    return (prop, value_for_arg(value, tipe))
+
+def count_issues(table, args):
+    """Count the issues and launches in the IssueTable for "all" or "<prop>=<val>".
+
+    Returns (number of issues, number of launches).
+    """
+    mask = table.all()
+    if args != "all":
+        mask = table.equals(*parse_prop_arg(args))
+    num_launches = table.count(mask & table.launch)
+    return (table.count(mask) - num_launches, num_launches)
 
 def generate_count_display(args):
     """Create a function to display a count."""
     title = args
-    if args == "all":
-        filter_pred = None
-    else:
-        filter_pred = create_pred_from_arg(args)
-        
-    def display(issues):
-        """Display the issues."""
-        if filter_pred is not None:
-            issues = filter(filter_pred, issues)
-        launches = filter(utils.issue_is_launch_p, issues)
-        non_launches = filter(utils.not_p(utils.issue_is_launch_p), issues)
+
+    def display(table):
+        """Display the issues in the IssueTable."""
+        (num_issues, num_launches) = count_issues(table, args)
         print "{title}: {num_issues} issues, {num_launches} launches".format(
-            title=title, num_issues=len(non_launches), num_launches=len(launches))
+            title=title, num_issues=num_issues, num_launches=num_launches)
 
     return display
 
 def generate_groups_display(prop, hint=3):
     """Create a function to display the groups."""
     title = prop
-    (prop_fn, _) = PROPERTY_FUNCTIONS[prop]
-    (print_fn, sort_by_issues) = PROPERTY_GROUPING[prop]
+    sort_by_issues = PROPERTY_GROUPING[prop]
 
-    def display(issues):
-        """Display the issues."""
+    def display(table):
+        """Display the issues in the IssueTable."""
         print_title("Issues by {title}".format(title=title))
-        print_fn(issues, prop_fn, hint=hint, sort_by_issues=sort_by_issues)
+        print_groups(table.group(prop), hint=hint, sort_by_issues=sort_by_issues, id_fn=int)
 
     return display
 
 def generate_quantiles_display(prop, quantiles):
     """Create a function to display the quantiles."""
 
-    (prop_fn, _) = PROPERTY_FUNCTIONS[prop]
+    def display(table):
+        """Display the issues in the IssueTable."""
+        print_title("Quantiles for {prop}".format(prop=prop))
+        print_quantile_values(table.quantiles(prop, quantiles, reverse=True))
+
+    return display
+
 
-    def display(issues):
-        """Display the issues."""
+def generate_sketch_display(prop, quantiles):
+    """Create a function to display the quantiles estimated by a QuantileSketch."""
+
+    def display(sketches):
+        """Display the quantiles from the {<prop>: <QuantileSketch>} sketches."""
         print_title("Quantiles for {prop}".format(prop=prop))
-        print_quantiles(map(prop_fn, issues), quantiles, reverse=True)
+        print_quantile_values(sketches[prop].quantiles(quantiles, reverse=True))
 
     return display
 
 
+def timed_display(name, display_fn):
+    """Time each call of the display function as a "display:<name>" phase."""
+    return profiling.timed("display:" + name)(display_fn)
+
+
 class TrackerHelper(object):
     def __init__(self, start, end, step_days):
         self._start = start
@@ -244,9 +236,17 @@ class TrackerHelper(object):
 
 
 class DisplayHelper(object):
-    """Help display issues."""
+    """Help display issues.
+
+    With a `table` (e.g. loaded from a snapshot), nothing is fetched and only
+    the displays an IssueTable can answer are allowed. With a `snapshot_path`,
+    a table of every property is built from the fetched issues and saved there.
+    With a `quantile_error`, quantiles are estimated with QuantileSketches,
+    built as the pages stream in unless another display fetches the issues.
+    """
 
-    def __init__(self, displays, quantiles=None, group_hint=3, start=None, end=None, step_days=None):
+    def __init__(self, displays, quantiles=None, group_hint=3, start=None, end=None, step_days=None,
+                 sharded=False, table=None, snapshot_path=None, quantile_error=None):
         if quantiles is not None:
             self._quantiles = quantiles
         else:
@@ -256,20 +256,73 @@ class DisplayHelper(object):
         self._tracker_start = start or datetime.date.today()
         self._tracker_end = end or self._tracker_start - datetime.timedelta(90)
         self._tracker_days = step_days or 7
+        self._sharded = sharded
+        self._table = table
+        self._snapshot_path = snapshot_path
+        self._quantile_error = quantile_error
 
     def display(self, query):
         """Display the given issues."""
-        issues = query.fetch_all_issues(authorize=_authorize)
         display_fns = self.generate_displays(self._displays)
-        for display_fn in display_fns:
-            if callable(display_fn):
-                display_fn(issues)
-            else:
-                (func, arg) = display_fn
-                if arg == "query":
-                    func(query)
-                elif arg == "issues":
-                    func(issues)
+        args = set(arg for (_, arg) in display_fns)
+        table = self._table
+        if table is not None and args != set(["table"]):
+            raise ValueError("Only count, groups and quantiles can be displayed from a snapshot")
+        save = self._snapshot_path is not None
+        issues = None
+        if table is None and (save or args.intersection(["issues", "table"]) or
+                              (self._sharded and "sketches" in args)):
+            with profiling.phase("issues:fetch"):
+                issues = query.fetch_sharded() if self._sharded else query.fetch_all_issues()
+        if "sketches" in args:
+            from quantiles import sketch_issues
+            prop_fns = dict((prop, PROPERTY_FUNCTIONS[prop][0])
+                            for prop in self.plan_sketches(self._displays))
+            with profiling.phase("issues:sketch"):
+                source = issues if issues is not None else query.iter_all_issues()
+                sketches = sketch_issues(source, prop_fns, self._quantile_error)
+        if table is None and (save or "table" in args):
+            from columns import IssueTable  # NumPy is only loaded for the displays that need it
+            with profiling.phase("issues:table"):
+                props = None if save else self.plan_columns(self._displays)
+                table = IssueTable(issues, props=props)
+        if save:
+            from snapshot import write_snapshot
+            with profiling.phase("issues:snapshot"):
+                write_snapshot(self._snapshot_path, table)
+        for (func, arg) in display_fns:
+            if arg == "query":
+                func(query)
+            elif arg == "issues":
+                func(issues)
+            elif arg == "table":
+                func(table)
+            elif arg == "sketches":
+                func(sketches)
+
+    def plan_columns(self, displays):
+        """Get the properties the count, groups and quantiles displays need.
+
+        The IssueTable extracts just these, in one pass over the issues, and
+        every display then reads the shared columns.
+        """
+        props = set()
+        for display in displays:
+            (kind, args) = display.split(":", 1)
+            if kind == "count" and args != "all":
+                props.add(parse_prop_arg(args)[0])
+            elif kind == "groups":
+                props.update(GROUP_DEFAULTS if args == "all" else [args])
+            elif kind == "quantiles" and self._quantile_error is None:
+                props.add(args)
+        return props
+
+    def plan_sketches(self, displays):
+        """Get the properties to sketch for the quantiles displays, if they are estimated."""
+        if self._quantile_error is None:
+            return set()
+        return set(display.split(":", 1)[1] for display in displays
+                   if display.split(":", 1)[0] == "quantiles")
 
     def generate_displays(self, displays):
         """Generate functions to display information about issues."""
@@ -281,57 +334,128 @@ class DisplayHelper(object):
             
             if kind == "count":
                 display_fn = generate_count_display(args)
-                display_fns.append(display_fn)
+                display_fns.append((timed_display(display, display_fn), "table"))
 
             if kind == "groups":
                 if args == "all":
                     for key in GROUP_DEFAULTS:
                         display_fn = generate_groups_display(key, hint=self._group_hint)
-                        display_fns.append(display_fn)
+                        display_fns.append((timed_display("groups:" + key, display_fn), "table"))
                 else:
                     display_fn = generate_groups_display(args, hint=self._group_hint)
-                    display_fns.append(display_fn)
+                    display_fns.append((timed_display(display, display_fn), "table"))
 
             if kind == "quantiles":
-                display_fn = generate_quantiles_display(args, self._quantiles)
-                display_fns.append(display_fn)
+                if self._quantile_error is None:
+                    display_fn = generate_quantiles_display(args, self._quantiles)
+                    display_fns.append((timed_display(display, display_fn), "table"))
+                else:
+                    display_fn = generate_sketch_display(args, self._quantiles)
+                    display_fns.append((timed_display(display, display_fn), "sketches"))
 
             if kind == "graph":
                 if args == "change":
                     display_fn = tracker_helper.generate_change_function()
-                    display_fns.append((display_fn, "query"))
+                    display_fns.append((timed_display(display, display_fn), "query"))
                 else:
                     display_fn = tracker_helper.generate_grid_function(args)
-                    display_fns.append((display_fn, "query"))
+                    display_fns.append((timed_display(display, display_fn), "query"))
 
         return display_fns
 
 
+def create_fetcher(arguments):
+    """Create the Fetcher for the command line arguments and make it the default."""
+    # Send credentials if necessary
+    credentials = CredentialManager() if arguments["--authorize"] else None
+    rate = float(arguments["--rate"]) if arguments["--rate"] is not None else None
+    deadline = float(arguments["--deadline"])
+    if deadline <= 0:
+        sys.exit("--deadline must be more than 0 seconds")
+    concurrency = int(arguments["--concurrency"])
+    if concurrency < 1:
+        sys.exit("--concurrency must be at least 1")
+    scheduler = RequestScheduler(rate=rate, deadline=deadline)
+    client_factory = None
+    # Authorized pages may be private, so they are never written to the disk cache
+    if not arguments["--no-http-cache"] and credentials is None:
+        from httpcache import BoundedFileCache, CachingHttp
+        http_cache = BoundedFileCache(arguments["--http-cache"],
+                                      max_bytes=int(arguments["--cache-size"]) * 1024 * 1024)
+        client_factory = partial(CachingHttp, http_cache, timeout=scheduler.deadline)
+    fetcher = Fetcher(concurrency=concurrency, credentials=credentials,
+                      scheduler=scheduler, client_factory=client_factory)
+    fetcher.metrics.watch_cache(get_default_cache())
+    set_default_fetcher(fetcher)
+    return fetcher
+
+def create_query(arguments, fetcher):
+    """Create the base query for the command line arguments."""
+    query = IssuesQuery(arguments["<project>"], fetcher=fetcher,
+                        base_url=arguments["--base-url"])
+    if arguments["--label"] is not None:
+        query = query.label(arguments["--label"])
+    return query
+
+
 def main():
     """Generate issues CSV."""
     arguments = docopt(__doc__, version='Naval Fate 2.0')
 
-    # Create an http client (authorized if necessary)
-    http = _authorize() if arguments["--authorize"] else None
+    # Create the shared fetcher and the base query to use
+    fetcher = create_fetcher(arguments)
+    query = create_query(arguments, fetcher)
 
-    # Build the base query to use
-    query = IssuesQuery(arguments["<project>"], client=http)
-    if arguments["--label"] is not None:
-        query = query.label(arguments["--label"])
+    # Serve from the local store, bringing it up to date first if asked
+    if arguments["--sync"] or arguments["--store"]:
+        store = IssueStore(arguments["<project>"], label=arguments["--label"])
+        if arguments["--sync"]:
+            store.sync(query)
+        query = query.use_store(store)
 
     # Create the display functions
     if arguments["--display"] is not None:
         displays = arguments["--display"].split(",")
+    elif arguments["--load"] is not None:
+        displays = ["count:all", "groups:all", "quantiles:published", "quantiles:updated"]
     else:
         displays = ["count:all", "groups:all", "quantiles:published", "quantiles:updated", 
                     "graph:priority", "graph:change"]
 
+    # Or display from a snapshot saved by an earlier run, which has no history
+    table = None
+    if arguments["--load"] is not None:
+        graphs = [display for display in displays if display.startswith("graph:")]
+        if len(graphs) > 0:
+            sys.exit("--load can't show the history graphs: " + ",".join(graphs))
+        if arguments["--sketch"] is not None:
+            sys.exit("--load can't estimate quantiles with --sketch; its quantiles are exact")
+        from snapshot import load_snapshot
+        table = load_snapshot(arguments["--load"])
+
     start = datetime.date.today() - datetime.timedelta(days=120)
     end = datetime.date.today()
-    displayer = DisplayHelper(displays, start=start, end=end, step_days=7)
+    quantile_error = float(arguments["--sketch"]) if arguments["--sketch"] is not None else None
+    if quantile_error is not None and not 0 < quantile_error < 1:
+        sys.exit("--sketch must be between 0 and 1")
+    displayer = DisplayHelper(displays, start=start, end=end, step_days=7,
+                              sharded=arguments["--shard"], table=table,
+                              snapshot_path=arguments["--snapshot"],
+                              quantile_error=quantile_error)
 
     # Dispaly
-    displayer.display(query)
+    if arguments["--profile"] is None:
+        displayer.display(query)
+    else:
+        profiling.enable()
+        start_time = timeit.default_timer()
+        (_, stats) = profiling.run_profiled(lambda: displayer.display(query))
+        report = profiling.summary(timeit.default_timer() - start_time, stats)
+        profiling.write_summary(arguments["--profile"], report)
+        print >> sys.stderr, "\n" + profiling.format_summary(report)
+
+    if arguments["--metrics"] is not None:
+        fetcher.metrics.write(arguments["--metrics"])
     
 if __name__ == "__main__":
     main()
@@ -0,0 +1,267 @@
+"""Metrics for the fetch layer: request latencies, sizes, retries and pool use.
+
+Every Fetcher keeps a FetchMetrics. At the end of a run it can be written
+out in the Prometheus text format or as JSON:
+    fetcher.metrics.write("metrics.prom")
+"""
+
+import json
+import threading
+import timeit
+
+# Upper bounds of the histogram buckets (the last bucket, +Inf, is implicit)
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+SIZE_BUCKETS = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+PAGES_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+METRIC_PREFIX = "issues_fetch_"
+
+
+class Histogram(object):
+    """A cumulative histogram over fixed buckets, as used by Prometheus."""
+
+    def __init__(self, buckets):
+        self._buckets = list(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        """Add a value to the histogram."""
+        i = 0
+        while i < len(self._buckets) and value > self._buckets[i]:
+            i += 1
+        self._counts[i] += 1
+        self._sum += value
+        self._count += 1
+
+    @property
+    def count(self):
+        """Get the number of values observed."""
+        return self._count
+
+    @property
+    def sum(self):
+        """Get the sum of the values observed."""
+        return self._sum
+
+    def cumulative_buckets(self):
+        """Get [(upper bound, number of values <= bound)], ending with ("+Inf", count)."""
+        buckets = []
+        total = 0
+        for (bound, count) in zip(self._buckets + ["+Inf"], self._counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+    def quantile(self, quantile):
+        """Estimate a quantile (0-100) as the upper bound of the bucket it falls in."""
+        if self._count == 0:
+            return None
+        rank = quantile / 100.0 * self._count
+        for (bound, total) in self.cumulative_buckets():
+            if total >= rank:
+                return bound
+        return "+Inf"
+
+
+class FetchMetrics(object):
+    """Thread-safe counters, gauges and histograms for a Fetcher.
+
+    Tracks per-request latency, response size and bytes actually
+    transferred (compressed, or nothing for a 304), retries and failures,
+    requests in flight, how busy the worker threads are, and how many pages
+    each query took. The statistics of a watched ResultCache are included too.
+    """
+
+    def __init__(self, concurrency, clock=timeit.default_timer):
+        self._concurrency = concurrency
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._started = clock()
+        self._latency = Histogram(LATENCY_BUCKETS)
+        self._sizes = Histogram(SIZE_BUCKETS)
+        self._pages = Histogram(PAGES_BUCKETS)
+        self._statuses = {}
+        self._retries = 0
+        self._hedges = 0
+        self._transferred = 0
+        self._errors = 0
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._busy_workers = 0
+        self._max_busy_workers = 0
+        self._busy_seconds = 0.0
+        self._cache = None
+
+    def watch_cache(self, cache):
+        """Include the hit/miss statistics of the ResultCache in the metrics."""
+        self._cache = cache
+
+    def request_started(self):
+        """Note that a request was sent. Returns its start time."""
+        with self._lock:
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        return self._clock()
+
+    def request_finished(self, started, status=None, size=0, transferred=None):
+        """Note that the request sent at `started` finished. A None status means it failed.
+
+        `size` is the size of the content and `transferred` the number of
+        bytes actually sent by the server (by default, the size).
+        """
+        latency = self._clock() - started
+        with self._lock:
+            self._in_flight -= 1
+            if status is None:
+                self._errors += 1
+                return
+            self._latency.observe(latency)
+            self._sizes.observe(size)
+            self._transferred += size if transferred is None else transferred
+            self._statuses[status] = self._statuses.get(status, 0) + 1
+
+    def request_retried(self):
+        """Note that a request had to be sent again."""
+        with self._lock:
+            self._retries += 1
+
+    def request_hedged(self):
+        """Note that a duplicate of a slow request was sent."""
+        with self._lock:
+            self._hedges += 1
+
+    def worker_started(self):
+        """Note that a worker thread picked up a task. Returns the start time."""
+        with self._lock:
+            self._busy_workers += 1
+            self._max_busy_workers = max(self._max_busy_workers, self._busy_workers)
+        return self._clock()
+
+    def worker_finished(self, started):
+        """Note that the task picked up at `started` finished."""
+        busy = self._clock() - started
+        with self._lock:
+            self._busy_workers -= 1
+            self._busy_seconds += busy
+
+    def query_fetched(self, num_pages):
+        """Note the number of pages a query took."""
+        with self._lock:
+            self._pages.observe(num_pages)
+
+    def stats(self):
+        """Get a snapshot of the metrics as a dict."""
+        with self._lock:
+            elapsed = self._clock() - self._started
+            capacity = self._concurrency * elapsed
+            return {
+                "requests": self._latency.count,
+                "responses_by_status": dict(self._statuses),
+                "errors": self._errors,
+                "retries": self._retries,
+                "hedges": self._hedges,
+                "bytes": int(self._sizes.sum),
+                "bytes_transferred": self._transferred,
+                "not_modified": self._statuses.get(304, 0),
+                "in_flight": self._in_flight,
+                "max_in_flight": self._max_in_flight,
+                "concurrency": self._concurrency,
+                "max_busy_workers": self._max_busy_workers,
+                "worker_busy_seconds": self._busy_seconds,
+                "worker_utilization": self._busy_seconds / capacity if capacity > 0 else 0.0,
+                "elapsed_seconds": elapsed,
+                "latency_seconds": _histogram_stats(self._latency),
+                "response_bytes": _histogram_stats(self._sizes),
+                "pages_per_query": _histogram_stats(self._pages),
+                "result_cache": self._cache.stats() if self._cache is not None else None,
+            }
+
+    def to_prometheus(self):
+        """Format the metrics in the Prometheus text exposition format."""
+        stats = self.stats()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            """Add a metric with its HELP and TYPE lines."""
+            name = METRIC_PREFIX + name
+            lines.append("# HELP {name} {help}".format(name=name, help=help_text))
+            lines.append("# TYPE {name} {kind}".format(name=name, kind=kind))
+            for (suffix, labels, value) in samples:
+                lines.append("{name}{suffix}{labels} {value}".format(
+                    name=name, suffix=suffix, labels=_format_labels(labels), value=value))
+
+        def histogram(name, help_text, histogram_stats):
+            """Add a histogram metric."""
+            samples = [("_bucket", [("le", bound)], count)
+                       for (bound, count) in histogram_stats["buckets"]]
+            samples.append(("_sum", [], histogram_stats["sum"]))
+            samples.append(("_count", [], histogram_stats["count"]))
+            metric(name, "histogram", help_text, samples)
+
+        metric("responses_total", "counter", "Responses received, by HTTP status.",
+               [("", [("status", status)], count)
+                for (status, count) in sorted(stats["responses_by_status"].items())])
+        metric("transferred_bytes_total", "counter", "Bytes sent by the server.",
+               [("", [], stats["bytes_transferred"])])
+        metric("errors_total", "counter", "Requests that failed without a response.",
+               [("", [], stats["errors"])])
+        metric("retries_total", "counter", "Requests sent again after a failed attempt.",
+               [("", [], stats["retries"])])
+        metric("hedges_total", "counter", "Duplicate requests sent for slow requests.",
+               [("", [], stats["hedges"])])
+        metric("in_flight", "gauge", "Requests currently in flight.",
+               [("", [], stats["in_flight"])])
+        metric("max_in_flight", "gauge", "Most requests in flight at once.",
+               [("", [], stats["max_in_flight"])])
+        metric("concurrency", "gauge", "Maximum number of workers and clients.",
+               [("", [], stats["concurrency"])])
+        metric("max_busy_workers", "gauge", "Most worker threads busy at once.",
+               [("", [], stats["max_busy_workers"])])
+        metric("worker_utilization", "gauge", "Fraction of worker capacity spent on tasks.",
+               [("", [], stats["worker_utilization"])])
+        histogram("latency_seconds", "Request latency in seconds.", stats["latency_seconds"])
+        histogram("response_bytes", "Response size in bytes.", stats["response_bytes"])
+        histogram("pages_per_query", "Pages fetched per query.", stats["pages_per_query"])
+        cache_stats = stats["result_cache"]
+        if cache_stats is not None:
+            for (name, help_text) in [("hits", "Results answered from the cache."),
+                                      ("misses", "Results not in the cache."),
+                                      ("coalesced", "Results shared with a load in flight."),
+                                      ("evictions", "Results evicted to keep the cache in size."),
+                                      ("expirations", "Results dropped once they expired.")]:
+                metric("result_cache_{name}_total".format(name=name), "counter", help_text,
+                       [("", [], cache_stats[name])])
+            metric("result_cache_entries", "gauge", "Results in the cache.",
+                   [("", [], cache_stats["entries"])])
+            metric("result_cache_bytes", "gauge", "Size of the results in the cache.",
+                   [("", [], cache_stats["bytes"])])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics to path: as JSON if it ends in .json, else in the Prometheus format."""
+        with open(path, "w") as f:
+            if path.endswith(".json"):
+                json.dump(self.stats(), f, indent=2, sort_keys=True)
+            else:
+                f.write(self.to_prometheus())
+
+
+def _histogram_stats(histogram):
+    """Get the JSON-friendly summary of a histogram."""
+    return {
+        "count": histogram.count,
+        "sum": histogram.sum,
+        "p50": histogram.quantile(50),
+        "p90": histogram.quantile(90),
+        "p99": histogram.quantile(99),
+        "buckets": histogram.cumulative_buckets(),
+    }
+
+def _format_labels(labels):
+    """Format Prometheus labels, e.g. {le="0.5"}."""
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join('{key}="{value}"'.format(key=key, value=value)
+                          for (key, value) in labels) + "}"
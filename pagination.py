@@ -0,0 +1,140 @@
+"""Plan the page sizes and offsets used to fetch every page of a query.
+
+The feed caps max-results at some server-specific size. The planner asks
+for large pages, learns the largest size the server actually returns, and
+sizes pages from how long pages and their entries take to arrive:
+    planner = get_default_planner()
+    limit = planner.page_size()
+    ...
+    planner.observe(limit, offset, page, seconds)
+"""
+
+from math import ceil
+import threading
+
+MIN_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 1000
+TARGET_PAGE_SECONDS = 2.0
+MAX_PAGE_BYTES = 8 * 1024 * 1024
+SPECULATIVE_PAGES = 4
+SMOOTHING = 0.3  # weight of the newest observation in the moving averages
+
+
+class PagePlanner(object):
+    """Choose page sizes from the server's cap and the observed cost per entry.
+
+    Thread-safe; one planner is meant to be shared by all the queries sent
+    to the same server.
+    """
+
+    def __init__(self, max_page_size=MAX_PAGE_SIZE, target_seconds=TARGET_PAGE_SECONDS,
+                 max_page_bytes=MAX_PAGE_BYTES, speculative_pages=SPECULATIVE_PAGES):
+        self._max_page_size = max_page_size
+        self._target_seconds = target_seconds
+        self._max_page_bytes = max_page_bytes
+        self._speculative_pages = speculative_pages
+        self._accepted = None  # the largest page size the server has returned
+        self._entry_seconds = None  # moving average of the seconds per entry
+        self._entry_bytes = None  # moving average of the bytes per entry
+        self._lock = threading.Lock()
+
+    @property
+    def accepted_page_size(self):
+        """Get the page size the server was found to cap pages at, or None if not yet seen."""
+        return self._accepted
+
+    def observe(self, limit, offset, page, seconds):
+        """Learn from a page fetched with the given limit and offset in `seconds`."""
+        num_entries = len(page.issues)
+        with self._lock:
+            total = page.total_results or 0
+            if num_entries < limit and offset + num_entries < total:
+                # More results remain, so the server capped the page size.
+                if self._accepted is None or num_entries < self._accepted:
+                    self._accepted = num_entries
+            if num_entries == 0:
+                return
+            entry_seconds = seconds / num_entries
+            self._entry_seconds = _average(self._entry_seconds, entry_seconds)
+            if page.size:
+                self._entry_bytes = _average(self._entry_bytes, float(page.size) / num_entries)
+
+    def _largest(self):
+        """Get the largest page size worth asking for."""
+        largest = self._max_page_size
+        if self._accepted is not None:
+            largest = min(largest, max(self._accepted, 1))
+        return largest
+
+    def page_size(self, remaining=None, workers=1):
+        """Get the page size to ask for.
+
+        Pages are as large as the server accepts while staying under the
+        target time and size. If `remaining` results are known, they are
+        spread over at least `workers` pages so the workers share them.
+        """
+        with self._lock:
+            size = self._largest()
+            if self._entry_seconds:
+                size = min(size, int(self._target_seconds / self._entry_seconds))
+            if self._entry_bytes:
+                size = min(size, int(self._max_page_bytes / self._entry_bytes))
+            if remaining is not None and workers > 1:
+                size = min(size, int(ceil(float(remaining) / workers)))
+            return max(size, min(MIN_PAGE_SIZE, self._largest()))
+
+    def speculative_pages(self, num_queries=1):
+        """Get how many pages to request for each query before its count is known."""
+        return max(1, self._speculative_pages // max(num_queries, 1))
+
+    def plan_remaining(self, total, fetched, workers=1, limit=None):
+        """Get the (offset, limit) pages still needed to cover results [0, total).
+
+        `fetched` is a list of (offset, number of entries) for pages already
+        fetched; the gaps between them are split into planned pages (of
+        `limit` results, if given).
+        """
+        gaps = []
+        position = 0
+        for (offset, num_entries) in sorted(fetched):
+            if offset > position:
+                gaps.append((position, min(offset, total)))
+            position = max(position, offset + num_entries)
+        if position < total:
+            gaps.append((position, total))
+
+        remaining = sum(end - start for (start, end) in gaps)
+        if remaining <= 0:
+            return []
+        if limit is None:
+            limit = self.page_size(remaining=remaining, workers=workers)
+        pages = []
+        for (start, end) in gaps:
+            for offset in range(start, end, limit):
+                pages.append((offset, min(limit, end - offset)))
+        return pages
+
+
+def _average(average, value):
+    """Fold the value into an exponential moving average."""
+    if average is None:
+        return value
+    return (1 - SMOOTHING) * average + SMOOTHING * value
+
+
+_default_planner = None
+_default_planner_lock = threading.Lock()
+
+def get_default_planner():
+    """Get the PagePlanner shared by queries that weren't given one."""
+    global _default_planner
+    with _default_planner_lock:
+        if _default_planner is None:
+            _default_planner = PagePlanner()
+        return _default_planner
+
+def set_default_planner(planner):
+    """Set the PagePlanner shared by queries that weren't given one."""
+    global _default_planner
+    with _default_planner_lock:
+        _default_planner = planner
@@ -0,0 +1,149 @@
+"""Phase timing and profiling hooks for report runs.
+
+Timing is off unless enable() is called, in which case phase() and timed()
+record the wall time and number of calls of each named phase:
+    with profiling.phase("parse"):
+        page = parse_page(content)
+
+run_profiled() also profiles the tasks that the Fetcher's worker threads
+run meanwhile, each under its own profiler (see profile_task), since
+cProfile only sees the thread that enabled it.
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+import json
+import threading
+import timeit
+
+_enabled = False
+_phases = {}  # <name>: [<calls>, <seconds>]
+_task_profiles = None  # profiles of worker tasks, while run_profiled runs
+_lock = threading.Lock()
+
+
+def enable():
+    """Start recording phases."""
+    global _enabled
+    _enabled = True
+
+def enabled():
+    """Test whether phases are being recorded."""
+    return _enabled
+
+def record(name, seconds):
+    """Record one call of the named phase."""
+    with _lock:
+        totals = _phases.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+@contextmanager
+def phase(name):
+    """Time the block as a call of the named phase."""
+    if not _enabled:
+        yield
+        return
+    start = timeit.default_timer()
+    try:
+        yield
+    finally:
+        record(name, timeit.default_timer() - start)
+
+def timed(name):
+    """Decorate a function so that each call is timed as the named phase."""
+    def decorator(fn):
+        """Wrap fn."""
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            """Call fn, timing it if profiling is enabled."""
+            with phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def phases():
+    """Get {name: {"calls": <calls>, "seconds": <seconds>}} for every recorded phase."""
+    with _lock:
+        return dict((name, {"calls": calls, "seconds": seconds})
+                    for (name, (calls, seconds)) in _phases.items())
+
+def hottest_functions(stats, module, prefix="", limit=10):
+    """Get the functions in module (a file name, or a tuple of them) whose names start with prefix.
+
+    `stats` is a pstats.Stats. Functions are ordered by total time.
+    """
+    functions = []
+    for ((filename, _, name), (_, calls, total, cumulative, _)) in stats.stats.items():
+        if filename.endswith(module) and name.startswith(prefix):
+            functions.append({"function": name, "calls": calls, "seconds": total,
+                              "cumulative_seconds": cumulative})
+    functions.sort(key=lambda function: function["seconds"], reverse=True)
+    return functions[:limit]
+
+def profile_task(fn, *args):
+    """Call fn on a worker thread, under its own profiler if run_profiled is running."""
+    if _task_profiles is None:
+        return fn(*args)
+    import cProfile
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(fn, *args)
+    finally:
+        with _lock:
+            if _task_profiles is not None:
+                _task_profiles.append(profile)
+
+def run_profiled(fn):
+    """Run fn under cProfile, along with the worker tasks it starts. Returns (result, stats).
+
+    `stats` is a pstats.Stats combining the profiles of this thread and the
+    worker tasks.
+    """
+    global _task_profiles
+    import cProfile
+    import pstats
+    with _lock:
+        _task_profiles = []
+    profile = cProfile.Profile()
+    try:
+        result = profile.runcall(fn)
+    finally:
+        with _lock:
+            (task_profiles, _task_profiles) = (_task_profiles, None)
+    stats = pstats.Stats(profile)
+    for task_profile in task_profiles:
+        stats.add(task_profile)
+    return (result, stats)
+
+def summary(wall_seconds, stats=None, limit=10):
+    """Build the report for a run: phases, slowest displays and (with pstats) hottest functions."""
+    recorded = phases()
+    displays = [dict(display=name[len("display:"):], **totals)
+                for (name, totals) in recorded.items() if name.startswith("display:")]
+    displays.sort(key=lambda display: display["seconds"], reverse=True)
+    report = {
+        "wall_seconds": wall_seconds,
+        "phases": recorded,
+        "slowest_displays": displays[:limit],
+    }
+    if stats is not None:
+        report["hottest_getters"] = hottest_functions(stats, "utils.py", "get_issue_", limit)
+        report["hottest_parsing"] = hottest_functions(stats, ("query.py", "utils.py"),
+                                                      limit=limit)
+    return report
+
+def write_summary(path, report):
+    """Write the report as JSON."""
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+def format_summary(report):
+    """Format the phases of the report as a table, slowest first."""
+    lines = ["{name:<40} {calls:>8} {seconds:>10}".format(name="phase", calls="calls",
+                                                        seconds="seconds")]
+    for (name, totals) in sorted(report["phases"].items(), key=lambda item: -item[1]["seconds"]):
+        lines.append("{name:<40} {calls:>8} {seconds:>10.4f}".format(name=name, **totals))
+    lines.append("{name:<40} {calls:>8} {seconds:>10.4f}".format(
+        name="total (wall)", calls="", seconds=report["wall_seconds"]))
+    return "\n".join(lines)
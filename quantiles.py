@@ -0,0 +1,186 @@
+"""Exact and streaming quantiles of issue property values."""
+
+from math import ceil
+import random
+
+DEFAULT_ERROR = 0.01
+
+
+def quantile_index(count, quantile, reverse=False):
+    """Get the index of the quantile among `count` sorted values.
+
+    Quantiles index into the values sorted ascending, or descending if
+    reverse is set (as print_quantiles has always done).
+    """
+    i = min(int(count * float(quantile) / 100), count - 1)
+    return count - 1 - i if reverse else i
+
+def select(values, k):
+    """Get the k-th smallest value (0-based) without sorting. Reorders values in place."""
+    lo = 0
+    hi = len(values) - 1
+    while lo < hi:
+        pivot = values[random.randint(lo, hi)]
+        i = lo
+        j = hi
+        while i <= j:
+            while values[i] < pivot:
+                i += 1
+            while pivot < values[j]:
+                j -= 1
+            if i <= j:
+                (values[i], values[j]) = (values[j], values[i])
+                i += 1
+                j -= 1
+        if k <= j:
+            hi = j
+        elif k >= i:
+            lo = i
+        else:
+            break
+    return values[k]
+
+def exact_quantiles(values, quantiles, reverse=False):
+    """Get the value at each quantile, ignoring None values.
+
+    NumPy arrays are handled with one np.partition call, other sequences with
+    quickselect, so the values are never fully sorted. Returns a list of
+    (quantile, value) pairs; the value is None if there are no values.
+    """
+    # NumPy arrays are recognised by their partition method, so that using
+    # this with lists doesn't need NumPy to be imported.
+    is_array = hasattr(values, "partition")
+    if is_array:
+        values = values.copy()
+    else:
+        values = [value for value in values if value is not None]
+    if len(values) == 0:
+        return [(quantile, None) for quantile in quantiles]
+
+    indexes = [quantile_index(len(values), quantile, reverse) for quantile in quantiles]
+    if is_array:
+        values.partition(sorted(set(indexes)))
+        return [(quantile, values[i]) for (quantile, i) in zip(quantiles, indexes)]
+    return [(quantile, select(values, i)) for (quantile, i) in zip(quantiles, indexes)]
+
+
+def sketch_issues(issues, prop_fns, error=DEFAULT_ERROR):
+    """Build a QuantileSketch of each property over issues, consuming them as they arrive.
+
+    `prop_fns` maps property names to their getters; returns {<name>: <sketch>}.
+    `issues` may be any iterable, e.g. IssuesQuery.iter_all_issues(), so the
+    sketches are built while the pages are still being fetched.
+    """
+    sketches = dict((prop, QuantileSketch(error=error)) for prop in prop_fns)
+    for issue in issues:
+        for (prop, prop_fn) in prop_fns.items():
+            sketches[prop].add(prop_fn(issue))
+    return sketches
+
+
+class _Compactor(list):
+    """One level of a QuantileSketch. Each item stands for 2**level original values."""
+
+    def compact(self, rng):
+        """Sort the level and keep every other item (odd or even at random) for the next level."""
+        self.sort()
+        leftover = [self.pop()] if len(self) % 2 else []
+        offset = rng.randint(0, 1)
+        promoted = self[offset::2]
+        self[:] = leftover
+        return promoted
+
+
+class QuantileSketch(object):
+    """A mergeable streaming quantile sketch (KLL).
+
+    Uses O(1/error) memory regardless of how many values are added. A
+    quantile query returns a value whose rank is within about
+    `error * count` of the requested rank. Sketches built on separate pages
+    or shards can be merged.
+        sketch = QuantileSketch(error=0.01)
+        for issue in query.iter_all_issues():
+            sketch.add(issue.published)
+        sketch.quantiles([99, 50, 0])
+    """
+
+    def __init__(self, error=DEFAULT_ERROR, seed=None):
+        self._k = max(8, int(ceil(2.0 / error)))
+        self._rng = random.Random(seed)
+        self._compactors = []
+        self._size = 0
+        self._max_size = 0
+        self._count = 0
+        self._grow()
+
+    def __len__(self):
+        return self._count
+
+    def _grow(self):
+        """Add a level to the sketch."""
+        self._compactors.append(_Compactor())
+        self._max_size = sum(self._capacity(level) for level in range(len(self._compactors)))
+
+    def _capacity(self, level):
+        """Get the number of items a level may hold. Lower levels hold fewer."""
+        depth = len(self._compactors) - level - 1
+        return int(ceil(self._k * (2.0 / 3) ** depth)) + 1
+
+    def _compress(self):
+        """Compact levels until the sketch is within its size limit."""
+        while self._size >= self._max_size:
+            for level in range(len(self._compactors)):
+                if len(self._compactors[level]) >= self._capacity(level):
+                    if level + 1 >= len(self._compactors):
+                        self._grow()
+                    promoted = self._compactors[level].compact(self._rng)
+                    self._compactors[level + 1].extend(promoted)
+                    break
+            self._size = sum(len(compactor) for compactor in self._compactors)
+
+    def add(self, value):
+        """Add a value to the sketch. None values are ignored."""
+        if value is None:
+            return
+        self._compactors[0].append(value)
+        self._size += 1
+        self._count += 1
+        if self._size >= self._max_size:
+            self._compress()
+
+    def update(self, values):
+        """Add each of the values to the sketch."""
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """Add everything summarized by another sketch to this one."""
+        while len(self._compactors) < len(other._compactors):
+            self._grow()
+        for (level, compactor) in enumerate(other._compactors):
+            self._compactors[level].extend(compactor)
+        self._count += other._count
+        self._size = sum(len(compactor) for compactor in self._compactors)
+        self._compress()
+
+    def quantiles(self, quantiles, reverse=False):
+        """Get the approximate value at each quantile. Returns (quantile, value) pairs."""
+        if self._count == 0:
+            return [(quantile, None) for quantile in quantiles]
+        weighted = []
+        for (level, compactor) in enumerate(self._compactors):
+            weighted.extend((value, 2 ** level) for value in compactor)
+        weighted.sort()
+        total = sum(weight for (_, weight) in weighted)
+
+        result = []
+        for quantile in quantiles:
+            # The rank we want among the (weighted) values, as an index from 0
+            rank = quantile_index(total, quantile, reverse)
+            seen = 0
+            for (value, weight) in weighted:
+                seen += weight
+                if seen > rank:
+                    break
+            result.append((quantile, value))
+        return result
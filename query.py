@@ -1,63 +1,226 @@
 """Class for querying the Google Code issue tracker."""
 
-import httplib2
 import copy
+from cStringIO import StringIO
 from urllib import urlencode
-from urlparse import urlunsplit
-import xml.etree.ElementTree as ET
-from math import ceil
-from multiprocessing import Pool
+from urlparse import urlsplit, urlunsplit
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 import datetime
-
-from utils import get_first_child_by_tag
-
-MAX_POOL_THREADS = 10
+from functools import partial
+import timeit
+
+from cache import get_default_cache
+from fetcher import get_default_fetcher
+from pagination import get_default_planner
+import profiling
+from utils import decode_issue, issue_is_open_p
+
+DEFAULT_BASE_URL = "https://code.google.com"
+FEED_PATH = "/feeds/issues/p/{project}/issues/full"
+SHARD_EPOCH = datetime.date(2006, 7, 1)  # before any project had issues
+MAX_SHARD_RESULTS = 5000
+
+def _published_before_p(ordinal):
+    """Test that the issue was opened before the day ordinal."""
+    return lambda issue: issue.published is not None and issue.published < ordinal
+
+def _published_after_p(ordinal):
+    """Test that the issue was opened on or after the day ordinal."""
+    return lambda issue: issue.published is not None and issue.published >= ordinal
+
+def _closed_before_p(ordinal):
+    """Test that the issue was closed before the day ordinal."""
+    return lambda issue: issue.closed is not None and issue.closed < ordinal
+
+def _closed_after_p(ordinal):
+    """Test that the issue was closed on or after the day ordinal."""
+    return lambda issue: issue.closed is not None and issue.closed >= ordinal
+
+# Search operators that IssuesQuery.local_predicate can evaluate against decoded issues
+LOCAL_DATE_OPERATORS = {
+    "opened-before": _published_before_p,
+    "opened-after": _published_after_p,
+    "closed-before": _closed_before_p,
+    "closed-after": _closed_after_p,
+}
+
+class FeedPage(object):
+    """A page of the issues feed. Only the decoded issues are kept."""
+
+    def __init__(self, total_results=None, next_url=None, issues=None, size=0):
+        self.total_results = total_results
+        self.next_url = next_url
+        self.issues = issues or []
+        self.size = size
+
+
+def iterparse_feed(source):
+    """Incrementally parse a feed from a file-like object.
+
+    Yields ("totalResults", int), ("next", url) and ("entry", Issue) items as
+    the corresponding top-level elements close. Each element is dropped from
+    the tree once it has been handled, so only one entry is held at a time.
+    """
+    depth = 0
+    root = None
+    for (event, elem) in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        if elem.tag.endswith("entry"):
+            yield ("entry", decode_issue(elem))
+        elif elem.tag.endswith("totalResults"):
+            yield ("totalResults", int(elem.text))
+        elif elem.tag.endswith("link") and elem.attrib.get("rel") == "next":
+            yield ("next", elem.attrib["href"])
+        root.clear()
+
+def parse_page(content):
+    """Parse the feed content into a FeedPage."""
+    page = FeedPage(size=len(content))
+    for (kind, value) in iterparse_feed(StringIO(content)):
+        if kind == "entry":
+            page.issues.append(value)
+        elif kind == "totalResults":
+            page.total_results = value
+        elif kind == "next":
+            page.next_url = value
+    return page
 
 def count_for_page(page):
     """Get the count for the given page."""
-    return int(get_first_child_by_tag(page, "totalResults").text)
+    return page.total_results
 
-def get_xml_tree_for_url(client, url):
-    """Get the xml tree for the given url."""
-    (_, content) = client.request(url, "GET")
-    return ET.fromstring(content)
+def get_page_for_url(fetcher, url):
+    """Get the parsed page for the given url."""
+    content = fetcher.request(url)
+    with profiling.phase("parse"):
+        return parse_page(content)
 
 def get_next_page_url(page):
     """Get the url of the next page."""
-    for child in page:
-        if child.tag.endswith("link") and child.attrib["rel"] == "next":
-            return child.attrib["href"]
-    return None
+    return page.next_url
 
-def get_next_page(client, page):
+def get_next_page(fetcher, page):
     """Get the next page of issues if one exists. Return None otherwise."""
     url = get_next_page_url(page)
     if url is None:
         return None
-    return get_xml_tree_for_url(client, url)
+    return get_page_for_url(fetcher, url)
 
 def get_issues_from_page(page):
-    """Return a list of the issues from the given page."""
-    entries = []
-    for child in page:
-        if child.tag.endswith("entry"):
-            entries.append(child)
-    return entries
-
-
-def _fetch_page_args(args):
-    """Helper function to call fetch_page on the query."""
-    (query, offset, limit, authorize) = args
-    if authorize is not None:
-        query._client = authorize()
-    return query.fetch_page(offset, limit)
-
-
-def _fetch_changes_for_range(args):
-    (query, start, end, authorize) = args
-    opened_issues = query.opened_in_range(start, end).fetch_all_issues(authorize=authorize)
-    closed_issues = query.closed_in_range(start, end).fetch_all_issues(authorize=authorize)
-    return (start, opened_issues, closed_issues)
+    """Return a list of the decoded issues from the given page."""
+    return page.issues
+
+
+def _fetch_planned_page(args):
+    """Helper function to fetch a page of the query and show it to the query's planner."""
+    (query, offset, limit) = args
+    start = timeit.default_timer()
+    page = query.fetch_page(offset, limit)
+    query.planner.observe(limit, offset, page, timeit.default_timer() - start)
+    return page
+
+def _count_query(query):
+    """Helper function to count the issues for a query, fetching a single result."""
+    return count_for_page(query.fetch_page(limit=1)) or 0
+
+@profiling.timed("fetch_all")
+def fetch_all(queries, limit=None):
+    """Fetch all issues for each of the queries, returning a list of issue lists.
+
+    The first pages of every query are fetched in one parallel batch, then
+    all of the remaining pages in a second one, so many small queries share
+    the fetcher's workers instead of each waiting on its own first page.
+    Unless a fixed `limit` is given, page sizes come from the queries'
+    PagePlanner, and several pages of each query are fetched speculatively
+    alongside the first one, before its count is known.
+    Queries that can be served from their store, or whose results are still
+    cached from an earlier fetch, don't hit the network.
+    """
+    results = [query._fetch_from_store() for query in queries]
+    results = [query._fetch_from_cache() if issues is None else issues
+               for (query, issues) in zip(queries, results)]
+    remote = [i for (i, issues) in enumerate(results) if issues is None]
+    if len(remote) == 0:
+        return results
+    fetcher = queries[remote[0]].fetcher
+    planner = queries[remote[0]].planner
+    workers = max(1, fetcher.concurrency // len(remote))
+
+    if limit is None:
+        first_limit = planner.page_size()
+        num_speculative = planner.speculative_pages(len(remote))
+    else:
+        (first_limit, num_speculative) = (limit, 1)
+    pages = dict((i, {}) for i in remote)  # <query index>: {<offset>: <page>}
+    tasks = [(i, page_num*first_limit, first_limit)
+             for i in remote for page_num in range(num_speculative)]
+    while len(tasks) > 0:
+        fetched = fetcher.map(_fetch_planned_page,
+                              [(queries[i], offset, page_limit) for (i, offset, page_limit) in tasks])
+        progressed = set()
+        for ((i, offset, _), page) in zip(tasks, fetched):
+            pages[i][offset] = page
+            if len(page.issues) > 0:
+                progressed.add(i)
+
+        # Plan the pages that are still missing, e.g. past the speculative
+        # ones or where the server returned fewer results than asked for.
+        tasks = []
+        for i in progressed:
+            total = max(count_for_page(page) or 0 for page in pages[i].values())
+            covered = [(offset, len(page.issues)) for (offset, page) in pages[i].items()]
+            tasks += [(i, offset, page_limit) for (offset, page_limit)
+                      in planner.plan_remaining(total, covered, workers=workers, limit=limit)]
+
+    for i in remote:
+        results[i] = []
+        for offset in sorted(pages[i]):
+            results[i] += get_issues_from_page(pages[i][offset])
+        fetcher.metrics.query_fetched(len(pages[i]))
+        queries[i]._cache_issues(results[i], sum(page.size for page in pages[i].values()))
+    return results
+
+def plan_shards(query, start, end, max_results=MAX_SHARD_RESULTS):
+    """Split the query into disjoint windows of the dates issues were opened on.
+
+    Returns a sorted list of (window start, window end, count) covering
+    every issue of the query, where a window of None to `start` holds the
+    issues opened before `start`. Windows are counted in parallel, and any
+    with more than `max_results` issues are split into as many equal
+    windows as their count calls for and counted again, down to single days.
+    Empty windows are dropped.
+    """
+    shards = []
+    windows = [(None, start), (start, end)]
+    while len(windows) > 0:
+        counts = query.fetcher.map(_count_query, [query.opened_in_window(window_start, window_end)
+                                                  for (window_start, window_end) in windows])
+        split = []
+        for ((window_start, window_end), count) in zip(windows, counts):
+            if count == 0:
+                continue
+            if window_start is None or count <= max_results or \
+                    (window_end - window_start).days <= 1:
+                shards.append((window_start, window_end, count))
+                continue
+            days = (window_end - window_start).days
+            num_parts = min(days, -(-count // max_results))
+            bounds = [window_start + datetime.timedelta(days=days * part // num_parts)
+                      for part in range(num_parts)] + [window_end]
+            split += zip(bounds[:-1], bounds[1:])
+        windows = split
+    shards.sort(key=lambda shard: shard[0] or datetime.date.min)
+    return shards
 
 class IssuesQuery(object):
     """Query the Google Code issue tracker.
@@ -68,26 +231,63 @@ class IssuesQuery(object):
         ui_5d_old_issues = base_query.label("Cr-UI").fetch_all_issues()
     """
 
-    def __init__(self, project, client=None, params=None, query=None):
-        if client is None:
-            client = httplib2.Http()
+    def __init__(self, project, fetcher=None, params=None, query=None, store=None, cache=None,
+                 base_url=DEFAULT_BASE_URL, planner=None):
+        if fetcher is None:
+            fetcher = get_default_fetcher()
+        if cache is None:
+            cache = get_default_cache()
+        if planner is None:
+            planner = get_default_planner()
 
         self._project = project
-        self._client = client
+        self._fetcher = fetcher
+        self._cache = cache
         self._query = query.split(" ") if query is not None else []
         self._params = params or {"can": "open"}
+        self._store = store
+        self._base_url = base_url
+        self._planner = planner
 
-    def _clone(self, project=None, client=None, params=None, query=None):
+    def _clone(self, project=None, fetcher=None, params=None, query=None):
         """Clone this IssuesQuery with the provided differences."""
         if project is None:
             project = self._project
-        if client is None:
-            client = self._client
+        if fetcher is None:
+            fetcher = self._fetcher
         if params is None:
             params = copy.deepcopy(self._params)
         if query is None:
             query = self._query
-        return IssuesQuery(self._project, client=client, params=params, query=" ".join(query))
+        return IssuesQuery(self._project, fetcher=fetcher, params=params, query=" ".join(query),
+                           store=self._store, cache=self._cache, base_url=self._base_url,
+                           planner=self._planner)
+
+    @property
+    def project(self):
+        """Get the project for the query."""
+        return self._project
+
+    @property
+    def fetcher(self):
+        """Get the Fetcher used for requests."""
+        return self._fetcher
+
+    @property
+    def planner(self):
+        """Get the PagePlanner that sizes the query's pages."""
+        return self._planner
+
+    @property
+    def params(self):
+        """Get a copy of the feed parameters for the query."""
+        return copy.deepcopy(self._params)
+
+    def use_store(self, store):
+        """Serve the query from the given IssueStore where possible. None disables it."""
+        query = self._clone()
+        query._store = store
+        return query
 
     def _update_params(self, key, value):
         """Update the params for this query."""
@@ -136,6 +336,13 @@ class IssuesQuery(object):
         """Filter to issues opened between the midnights starting start_date and end_date."""
         return self.can("all").opened_after(start_date).opened_before(end_date)
 
+    def opened_in_window(self, start_date, end_date):
+        """Like opened_in_range, but keep can, and a None start_date leaves the window open."""
+        query = self.opened_before(end_date)
+        if start_date is not None:
+            query = query.opened_after(start_date)
+        return query
+
     def closed_before(self, date):
         """Filter to issues closed before midnight at the start of the given date."""
         return self._add_date_query("closed-before", date)
@@ -148,6 +355,46 @@ class IssuesQuery(object):
         """Filter to issues closed between the midnights starting start_date and end_date."""
         return self.can("all").closed_after(start_date).closed_before(end_date)
 
+    def updated_after(self, time):
+        """Filter to issues updated at or after the given datetime (UTC)."""
+        return self._update_params("updated-min", time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+    def local_predicate(self):
+        """Get a predicate equivalent to the query's can and search terms.
+
+        Returns None if the query uses anything that can't be evaluated
+        against decoded issues (e.g. can=owned or free text search).
+        """
+        can = self._params.get("can")
+        if can == "open":
+            preds = [issue_is_open_p]
+        elif can == "all":
+            preds = []
+        else:
+            return None
+        if "updated-min" in self._params:
+            return None
+        for term in self._query:
+            if term == "":
+                continue
+            (attribute, _, value) = term.partition(":")
+            if attribute not in LOCAL_DATE_OPERATORS:
+                return None
+            try:
+                (year, month, day) = [int(part) for part in value.split("/")]
+                ordinal = datetime.date(year, month, day).toordinal()
+            except ValueError:
+                return None
+            preds.append(LOCAL_DATE_OPERATORS[attribute](ordinal))
+
+        def pred(issue):
+            """Test that the issue matches every part of the query."""
+            for term_pred in preds:
+                if not term_pred(issue):
+                    return False
+            return True
+        return pred
+
     def to_url(self, offset=0, limit=25):
         """Convert this query to a URL."""
         params = copy.deepcopy(self._params)
@@ -156,45 +403,107 @@ class IssuesQuery(object):
         if len(self._query) > 0:
             params["q"] = " ".join(self._query)
         query = urlencode(params)
-        path = "/feeds/issues/p/{project}/issues/full".format(project=self._project)
-        return urlunsplit(("https", "code.google.com", path, query, ""))
+        (scheme, netloc, base_path, _, _) = urlsplit(self._base_url)
+        path = base_path.rstrip("/") + FEED_PATH.format(project=self._project)
+        return urlunsplit((scheme, netloc, path, query, ""))
+
+    def cache_key(self):
+        """Get a key for the query's results, whatever order its terms and params were added in."""
+        params = sorted(self._params.items())
+        terms = sorted(term for term in self._query if term)
+        if len(terms) > 0:
+            params.append(("q", " ".join(terms)))
+        return (self._base_url, self._project, urlencode(params))
 
     def fetch_page(self, offset=0, limit=25):
-        """Fetch the issues page for the query using offset and limit."""
+        """Fetch the issues page for the query using offset and limit.
+
+        Pages are cached under the query's cache_key, and concurrent requests
+        for the same page are coalesced into one. The returned page must not
+        be modified.
+        """
         url = self.to_url(offset=offset, limit=limit)
-        return get_xml_tree_for_url(self._client, url)
+        return self._cache.get_or_load(self.cache_key() + (offset, limit),
+                                       partial(get_page_for_url, self._fetcher, url))
 
-    def fetch_all_issues(self, limit=25, verbose=False, authorize=None):
-        """Fetch all issues for the query."""
-        page = self.fetch_page(limit=limit)
-        count = count_for_page(page)
+    def _fetch_from_store(self):
+        """Get the issues for the query from the store, or None if it can't answer it."""
+        if self._store is None:
+            return None
+        return self._store.fetch(self)
+
+    def _fetch_from_cache(self):
+        """Get the issues for the query if a fetch of all of them is cached, else None.
 
-        pages = [page]
-        num_pages = int(ceil(float(count) / float(limit)))
-        if num_pages > 1:
-            pool = Pool(min(num_pages, MAX_POOL_THREADS))
-            arg_gen = ((self, page*limit, limit, authorize) for page in range(1, num_pages))
-            pages += pool.map(_fetch_page_args, arg_gen)
-            pool.close()
+        Unlike pages, these are shared by fetches that used different page sizes.
+        """
+        issues = self._cache.get(self.cache_key())
+        return list(issues) if issues is not None else None
 
+    def _cache_issues(self, issues, size):
+        """Cache all the issues for the query, fetched as `size` bytes of pages."""
+        self._cache.put(self.cache_key(), list(issues), size)
+
+    def fetch_all_issues(self, limit=None, verbose=False):
+        """Fetch all issues for the query."""
+        return fetch_all([self], limit=limit)[0]
+
+    def fetch_sharded(self, max_results=MAX_SHARD_RESULTS, start=SHARD_EPOCH, end=None):
+        """Fetch all issues for the query in parallel shards by the date they were opened.
+
+        Rather than paging through one long result set, the query is split
+        into windows of at most about `max_results` issues (see plan_shards),
+        and the windows are fetched together. Issues are returned in window
+        order, with any duplicates dropped.
+        """
+        issues = self._fetch_from_store()
+        if issues is not None:
+            return issues
+        if end is None:
+            end = datetime.date.today() + datetime.timedelta(days=1)
+        shards = plan_shards(self, start, end, max_results=max_results)
+        results = fetch_all([self.opened_in_window(shard_start, shard_end)
+                             for (shard_start, shard_end, _) in shards])
         issues = []
-        for page in pages:
-            issues += get_issues_from_page(page)
+        seen = set()
+        for shard_issues in results:
+            for issue in shard_issues:
+                if issue.id not in seen:
+                    seen.add(issue.id)
+                    issues.append(issue)
         return issues
 
-    def fetch_changes_for_range(self, start, end, days, authorize=None):
-        date = start
-        ranges = []
-        while date < end:
-            end_date = date + datetime.timedelta(days=days)
-            ranges.append((date, end_date))
-            date = date + datetime.timedelta(days=days)
-
-        pool = Pool(min(len(ranges), MAX_POOL_THREADS))
-        arg_gen = ((self, start, end, authorize) for (start, end) in ranges)
-        changes = pool.map(_fetch_changes_for_range, arg_gen)
-        pool.close()
-        return changes
+    def iter_pages(self, limit=None, max_pending=None):
+        """Yield the pages for the query as they arrive.
+
+        The first page comes first (it holds the total count); the rest are
+        yielded in completion order, with at most `max_pending` requests in
+        flight or waiting on the consumer. Page sizes come from the planner
+        unless a fixed `limit` is given.
+        """
+        first_limit = limit or self._planner.page_size()
+        page = _fetch_planned_page((self, 0, first_limit))
+        yield page
+        remaining = self._planner.plan_remaining(count_for_page(page) or 0,
+                                                 [(0, len(page.issues))],
+                                                 workers=self._fetcher.concurrency, limit=limit)
+        self._fetcher.metrics.query_fetched(1 + len(remaining))
+        args = ((self, offset, page_limit) for (offset, page_limit) in remaining)
+        for (_, page) in self._fetcher.stream(_fetch_planned_page, args, max_pending=max_pending):
+            yield page
+
+    def iter_all_issues(self, limit=None, max_pending=None):
+        """Yield all issues for the query, page by page as they arrive."""
+        issues = self._fetch_from_store()
+        if issues is None:
+            issues = self._fetch_from_cache()
+        if issues is not None:
+            for issue in issues:
+                yield issue
+            return
+        for page in self.iter_pages(limit=limit, max_pending=max_pending):
+            for issue in get_issues_from_page(page):
+                yield issue
 
     def count(self):
         """Get the number of issues for the query."""
@@ -0,0 +1,301 @@
+"""Schedule feed requests: rate limiting, retries with backoff, hedging and deadlines.
+
+The Fetcher hands every request to a RequestScheduler:
+    scheduler = RequestScheduler(rate=20)
+    (response, content) = scheduler.run(lambda: client.request(url, "GET"))
+
+- A token bucket keeps requests under `rate` per second, and a Retry-After
+  hint from the server pauses every request, not just the one that got it.
+- Throttled (429/503) and failed (5xx or connection error) attempts are
+  retried with jittered exponential backoff.
+- Once enough requests have been seen, an attempt that runs longer than the
+  `hedge_percentile` latency gets a duplicate; whichever answers first wins.
+- Each request, retries included, must finish within `deadline` seconds.
+"""
+
+import httplib
+import Queue
+import random
+import socket
+import sys
+import threading
+import time
+import timeit
+
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF = 0.5  # seconds before the first retry
+DEFAULT_MAX_BACKOFF = 30
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_MAX_HEDGES = 2  # hedged attempts in flight at once
+DEFAULT_DEADLINE = 60  # seconds
+MIN_HEDGE_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+RETRY_STATUSES = set([429, 500, 502, 503, 504])
+
+
+def retry_errors():
+    """Get the exception types of failed attempts that are worth retrying."""
+    import httplib2  # already loaded by the time there is a request to retry
+    return (socket.error, httplib.HTTPException, httplib2.HttpLib2Error)
+
+
+class RequestError(Exception):
+    """A request failed for good. `status` is the last HTTP status, if there was a response."""
+
+    def __init__(self, message, status=None):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class DeadlineExceeded(RequestError):
+    """A request (with its retries) didn't finish within its deadline."""
+    pass
+
+
+class TokenBucket(object):
+    """Allow `rate` events per second on average, in bursts of up to `burst`.
+
+    A rate of None, or of 0 or less, allows everything (but pause still applies).
+    """
+
+    def __init__(self, rate=None, burst=None, clock=timeit.default_timer, sleep=time.sleep):
+        if rate is not None and rate <= 0:
+            rate = None
+        self._rate = rate
+        self._burst = burst or max(rate or 1, 1)
+        self._tokens = float(self._burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._paused_until = None
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Hold back every event for the given number of seconds."""
+        with self._lock:
+            until = self._clock() + seconds
+            if self._paused_until is None or until > self._paused_until:
+                self._paused_until = until
+
+    def _wait_time(self):
+        """Take a token if one is available now; otherwise get how long to wait for one."""
+        now = self._clock()
+        if self._paused_until is not None and now < self._paused_until:
+            return self._paused_until - now
+        if self._rate is None:
+            return 0
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self._rate
+
+    def acquire(self, deadline=None):
+        """Wait for a token. Returns False, without one, if it can't be had before the deadline."""
+        while True:
+            with self._lock:
+                wait = self._wait_time()
+            if wait <= 0:
+                return True
+            if deadline is not None and self._clock() + wait > deadline:
+                return False
+            self._sleep(wait)
+
+
+class LatencyTracker(object):
+    """Keep the latencies of the most recent requests to estimate percentiles."""
+
+    def __init__(self, window=LATENCY_WINDOW, min_samples=MIN_HEDGE_SAMPLES):
+        self._window = window
+        self._min_samples = min_samples
+        self._samples = []
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        """Record a latency."""
+        with self._lock:
+            if len(self._samples) < self._window:
+                self._samples.append(seconds)
+            else:
+                self._samples[self._next] = seconds
+                self._next = (self._next + 1) % self._window
+
+    def percentile(self, percentile):
+        """Get the latency at the percentile (0-100), or None until there are enough samples."""
+        with self._lock:
+            if len(self._samples) < self._min_samples:
+                return None
+            samples = sorted(self._samples)
+        index = min(int(len(samples) * percentile / 100.0), len(samples) - 1)
+        return samples[index]
+
+
+def retry_delay(attempt, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                retry_after=None):
+    """Get the delay before retry number `attempt` (0-based), honoring a Retry-After hint."""
+    if retry_after is not None:
+        return min(retry_after, max_backoff)
+    delay = min(backoff * (2 ** attempt), max_backoff)
+    return random.uniform(delay / 2, delay)
+
+def parse_retry_after(response):
+    """Get the Retry-After hint of a response in seconds, or None."""
+    value = response.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        # HTTP dates aren't worth supporting here; fall back to backoff.
+        return None
+
+
+class RequestScheduler(object):
+    """Run requests under a rate limit, with retries, hedging and a deadline.
+
+    A request is a function that makes one attempt and returns (response,
+    content) like httplib2.Http.request. Once hedging is possible, attempts
+    run on their own threads so that a hedge or the deadline can overtake a
+    slow one; the losing attempt is left to finish in the background and its
+    result dropped.
+    Thread-safe; one scheduler is meant to be shared by every request a
+    Fetcher makes.
+    """
+
+    def __init__(self, rate=None, burst=None, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 hedge_percentile=DEFAULT_HEDGE_PERCENTILE, max_hedges=DEFAULT_MAX_HEDGES,
+                 deadline=DEFAULT_DEADLINE, clock=timeit.default_timer, sleep=time.sleep):
+        if deadline <= 0:
+            raise ValueError("The deadline must be more than 0 seconds")
+        self._bucket = TokenBucket(rate, burst, clock=clock, sleep=sleep)
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._hedge_percentile = hedge_percentile
+        self._max_hedges = max_hedges
+        self._hedges = threading.BoundedSemaphore(max_hedges) if max_hedges > 0 else None
+        self._deadline = deadline
+        self._latencies = LatencyTracker()
+        self._clock = clock
+        self._sleep = sleep
+
+    @property
+    def max_hedges(self):
+        """Get the most hedged attempts that can be in flight at once."""
+        return self._max_hedges
+
+    @property
+    def deadline(self):
+        """Get the seconds each request has to finish."""
+        return self._deadline
+
+    def run(self, send, metrics=None):
+        """Make the request, retrying and hedging as needed. Returns (response, content).
+
+        Raises RequestError if it fails for good or DeadlineExceeded if it
+        runs out of time. `metrics`, if given, is a FetchMetrics to record
+        retries and hedges in.
+        """
+        deadline = self._clock() + self._deadline
+        attempt = 0
+        while True:
+            if not self._bucket.acquire(deadline):
+                raise DeadlineExceeded("No request slot before the deadline")
+            retry_after = None
+            try:
+                (response, content) = self._race(send, deadline, metrics)
+            except DeadlineExceeded:
+                raise
+            except retry_errors() as e:
+                (status, error) = (None, e)
+            else:
+                if response.status not in RETRY_STATUSES:
+                    if response.status >= 400:
+                        raise RequestError("HTTP {status}".format(status=response.status),
+                                           response.status)
+                    return (response, content)
+                (status, error) = (response.status, "HTTP {0}".format(response.status))
+                retry_after = parse_retry_after(response)
+                if retry_after is not None:
+                    self._bucket.pause(retry_after)
+
+            if attempt >= self._max_retries:
+                raise RequestError("Gave up after {n} attempts: {error}".format(
+                    n=attempt + 1, error=error), status)
+            delay = retry_delay(attempt, self._backoff, self._max_backoff, retry_after)
+            if self._clock() + delay > deadline:
+                raise DeadlineExceeded("No time left to retry: {error}".format(error=error),
+                                       status)
+            if metrics is not None:
+                metrics.request_retried()
+            self._sleep(delay)
+            attempt += 1
+
+    def _race(self, send, deadline, metrics):
+        """Make one attempt, hedging it if it runs slow. Returns the first successful result.
+
+        Until there are enough latencies to tell what slow is, the attempt
+        runs on the calling thread, with the client's socket timeout standing
+        in for the deadline. Otherwise it runs on its own thread while this
+        one waits, starting a hedge if it is slow. If every attempt fails,
+        the last failure is raised.
+        """
+        threshold = self._latencies.percentile(self._hedge_percentile)
+        if threshold is None or self._hedges is None:
+            return self._attempt(send)
+
+        results = Queue.Queue()
+        self._start(send, results)
+        hedge_at = self._clock() + threshold
+        pending = 1
+        while pending > 0:
+            wait_until = deadline if hedge_at is None else min(hedge_at, deadline)
+            try:
+                (kind, value) = results.get(timeout=max(wait_until - self._clock(), 0))
+            except Queue.Empty:
+                if self._clock() >= deadline:
+                    raise DeadlineExceeded("Request didn't finish before the deadline")
+                hedge_at = None
+                if self._hedges.acquire(False):
+                    if metrics is not None:
+                        metrics.request_hedged()
+                    self._start(send, results, release=self._hedges.release)
+                    pending += 1
+                continue
+            if kind == "ok" and value[0].status not in RETRY_STATUSES:
+                return value
+            # Give any other attempt its chance before reporting the failure.
+            pending -= 1
+            outcome = (kind, value)
+        (kind, value) = outcome
+        if kind == "failed":
+            raise value[0], value[1], value[2]
+        return value
+
+    def _attempt(self, send):
+        """Make an attempt on the calling thread, recording its latency."""
+        started = self._clock()
+        value = send()
+        self._latencies.add(self._clock() - started)
+        return value
+
+    def _start(self, send, results, release=None):
+        """Start an attempt on its own thread, putting its outcome on results."""
+        def attempt():
+            """Make the attempt."""
+            try:
+                value = self._attempt(send)
+            except Exception:
+                results.put(("failed", sys.exc_info()))
+            else:
+                results.put(("ok", value))
+            finally:
+                if release is not None:
+                    release()
+        thread = threading.Thread(target=attempt)
+        thread.daemon = True
+        thread.start()
@@ -0,0 +1,164 @@
+"""Compact binary snapshots of an IssueTable that load with mmap, without copying.
+
+A snapshot holds every column as a fixed-width little-endian array, with
+the owners, statuses, types and labels coded against one string dictionary:
+    write_snapshot("chromium.snap", IssueTable(issues))
+    table = load_snapshot("chromium.snap")
+
+Layout: MAGIC, then the version and the length of a JSON header (two
+little-endian uint32s), then the header, then the arrays, each starting on
+an ALIGNMENT-byte boundary. The header has the number of issues, the kind
+of each column and the (dtype, offset, length) of each array, with offsets
+counted from the end of the (padded) header. The file is written in one
+call; loading maps it and points NumPy arrays into the map, so processes
+that load the same snapshot share its pages.
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from columns import COLUMNS, KEY_FUNCTIONS, CategoryColumn, IssueTable, MultiColumn, NumberColumn
+
+MAGIC = "ISSUESNP"
+SNAPSHOT_VERSION = 1
+ALIGNMENT = 8
+PREAMBLE = struct.Struct("<II")  # version, header length
+NO_STRING = -1  # the string code of None
+
+
+class StringDictionary(object):
+    """Assign integer codes to distinct strings. None is coded as NO_STRING."""
+
+    def __init__(self):
+        self._codes = {}
+        self._strings = []
+
+    def codes(self, values):
+        """Get the int32 array of codes of the values, adding new strings to the dictionary."""
+        codes = np.empty(len(values), dtype="<i4")
+        for (i, value) in enumerate(values):
+            if value is None:
+                codes[i] = NO_STRING
+                continue
+            if not isinstance(value, basestring):
+                raise ValueError("Can't store {value!r} in a snapshot".format(value=value))
+            if isinstance(value, unicode):
+                value = value.encode("utf-8")
+            if value not in self._codes:
+                self._codes[value] = len(self._strings)
+                self._strings.append(value)
+            codes[i] = self._codes[value]
+        return codes
+
+    def arrays(self):
+        """Get (offsets, data): the strings' UTF-8 bytes concatenated, and where each starts."""
+        lengths = np.array([len(string) for string in self._strings], dtype="<i8")
+        offsets = np.concatenate([np.zeros(1, dtype="<i8"), np.cumsum(lengths, dtype="<i8")])
+        return (offsets, np.frombuffer("".join(self._strings), dtype=np.uint8))
+
+
+def _decode(string):
+    """Get a string as ElementTree returns it: str if it's ASCII, else unicode."""
+    try:
+        string.decode("ascii")
+        return string
+    except UnicodeDecodeError:
+        return string.decode("utf-8")
+
+def _little_endian(array):
+    """Get the array as a contiguous little-endian array."""
+    return np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+
+def _padding(length):
+    """Get the padding that brings length to the next ALIGNMENT boundary."""
+    return "\0" * (-length % ALIGNMENT)
+
+
+def write_snapshot(path, table):
+    """Write the table to a snapshot at path, replacing any file there atomically."""
+    strings = StringDictionary()
+    arrays = [("ids", table.ids), ("launch", table.launch)]
+    columns = {}
+    for prop in table.props:
+        kind = COLUMNS[prop][0]
+        column = table.column(prop)
+        columns[prop] = kind
+        if kind == "category":
+            arrays.append((prop + ".codes", column.codes))
+            arrays.append((prop + ".categories", strings.codes(column.categories)))
+        elif kind in KEY_FUNCTIONS:
+            arrays.append((prop + ".values", column.values))
+            arrays.append((prop + ".null", column.null))
+        else:
+            arrays.append((prop + ".codes", column.codes))
+            arrays.append((prop + ".rows", column.rows))
+            arrays.append((prop + ".categories", strings.codes(column.categories)))
+    (offsets, data) = strings.arrays()
+    arrays += [("strings.offsets", offsets), ("strings.data", data)]
+
+    arrays = [(name, _little_endian(array)) for (name, array) in arrays]
+    header = {"size": len(table), "columns": columns, "arrays": {}}
+    position = 0
+    for (name, array) in arrays:
+        header["arrays"][name] = [array.dtype.str, position, len(array)]
+        position += array.nbytes + len(_padding(array.nbytes))
+    encoded = json.dumps(header, sort_keys=True)
+
+    parts = [MAGIC, PREAMBLE.pack(SNAPSHOT_VERSION, len(encoded)), encoded,
+             _padding(len(MAGIC) + PREAMBLE.size + len(encoded))]
+    for (_, array) in arrays:
+        parts.append(array.tobytes())
+        parts.append(_padding(array.nbytes))
+    directory = os.path.dirname(os.path.abspath(path))
+    (fd, temp_path) = tempfile.mkstemp(dir=directory, prefix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write("".join(parts))
+    os.rename(temp_path, path)
+
+def load_snapshot(path):
+    """Load the IssueTable in the snapshot at path. Its arrays are read-only views of the file."""
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    prefix_length = len(MAGIC) + PREAMBLE.size
+    if len(data) < prefix_length or data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not an issue snapshot: " + path)
+    (version, header_length) = PREAMBLE.unpack(data[len(MAGIC):prefix_length])
+    if version != SNAPSHOT_VERSION:
+        raise ValueError("Unsupported snapshot version {version}: {path}".format(
+            version=version, path=path))
+    header = json.loads(data[prefix_length:prefix_length + header_length])
+    arrays_start = prefix_length + header_length + len(_padding(prefix_length + header_length))
+
+    def array(name):
+        """Get a view of the named array."""
+        (dtype, offset, length) = header["arrays"][name]
+        return np.frombuffer(data, dtype=str(dtype), count=length, offset=arrays_start + offset)
+
+    offsets = array("strings.offsets")
+    start = arrays_start + header["arrays"]["strings.data"][1]
+    strings = [_decode(data[start + begin:start + end])
+               for (begin, end) in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+    def categories(name):
+        """Get the values of the named array of string codes."""
+        return [None if code == NO_STRING else strings[code] for code in array(name).tolist()]
+
+    size = header["size"]
+    columns = {}
+    for (prop, kind) in header["columns"].items():
+        if kind == "category":
+            column = CategoryColumn.from_codes(array(prop + ".codes"),
+                                               categories(prop + ".categories"))
+        elif kind in KEY_FUNCTIONS:
+            column = NumberColumn.from_arrays(array(prop + ".values"), array(prop + ".null"),
+                                              to_key=KEY_FUNCTIONS[kind])
+        else:
+            column = MultiColumn.from_codes(array(prop + ".codes"), array(prop + ".rows"),
+                                            categories(prop + ".categories"), size)
+        columns[str(prop)] = column
+    return IssueTable.from_columns(array("ids"), array("launch"), columns)
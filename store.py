@@ -0,0 +1,101 @@
+"""Persistent local store of issues, kept up to date from the issue feed."""
+
+import cPickle as pickle
+import datetime
+import os
+
+STORE_DIR = ".issues"
+STORE_VERSION = 1
+
+# Re-request a little before the watermark to cover clock skew and slow index updates.
+SYNC_OVERLAP = datetime.timedelta(hours=1)
+
+
+class IssueStore(object):
+    """All issues (open and closed) for a project/label, keyed by issue id.
+
+    The first sync fetches every issue. Later syncs only fetch issues updated
+    since the previous sync and upsert them.
+        store = IssueStore("myproject", label="Cr-UI")
+        store.sync(IssuesQuery("myproject").label("Cr-UI"))
+        issues = IssuesQuery("myproject").label("Cr-UI").use_store(store).fetch_all_issues()
+    """
+
+    def __init__(self, project, label=None, directory=STORE_DIR):
+        self._project = project
+        self._label = label
+        self._directory = directory
+        self._issues = {}
+        self._watermark = None
+        self._load()
+
+    @property
+    def path(self):
+        """Get the path of the file backing the store."""
+        name = self._project if self._label is None else "{project}-{label}".format(
+            project=self._project, label=self._label)
+        return os.path.join(self._directory, name + ".pickle")
+
+    @property
+    def watermark(self):
+        """Get the (UTC) datetime the store was last synced, or None."""
+        return self._watermark
+
+    @property
+    def issues(self):
+        """Get all issues in the store."""
+        return self._issues.values()
+
+    def _load(self):
+        """Load the store from disk if it exists."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            (version, watermark, issues) = pickle.load(f)
+        if version != STORE_VERSION:
+            return
+        self._watermark = watermark
+        self._issues = dict((issue.id, issue) for issue in issues)
+
+    def save(self):
+        """Write the store to disk, replacing the previous file atomically."""
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((STORE_VERSION, self._watermark, self._issues.values()), f,
+                        pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self.path)
+
+    def upsert(self, issues):
+        """Add issues to the store, replacing older versions with the same id."""
+        for issue in issues:
+            self._issues[issue.id] = issue
+
+    def sync(self, query, now=None):
+        """Bring the store up to date using the given query. Return the number of issues fetched.
+
+        The query should be for the same project and label as the store.
+        """
+        now = now or datetime.datetime.utcnow()
+        query = query.use_store(None).all()
+        if self._watermark is not None:
+            query = query.updated_after(self._watermark - SYNC_OVERLAP)
+        issues = query.fetch_all_issues()
+        self.upsert(issues)
+        self._watermark = now
+        self.save()
+        return len(issues)
+
+    def can_serve(self, query):
+        """Test whether the store can answer the given query."""
+        return (self._watermark is not None and
+                query.project == self._project and
+                query.params.get("label") == self._label and
+                query.local_predicate() is not None)
+
+    def fetch(self, query):
+        """Get the stored issues matching the query, or None if the store can't answer it."""
+        if not self.can_serve(query):
+            return None
+        return filter(query.local_predicate(), self._issues.values())
@@ -0,0 +1,154 @@
+"""Deterministic synthetic issue feeds, for benchmarks and load tests."""
+
+from bisect import bisect_left
+import datetime
+import random
+from xml.sax.saxutils import escape, quoteattr
+
+FEED_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>'
+               '<feed xmlns="http://www.w3.org/2005/Atom" '
+               'xmlns:openSearch="http://a9.com/-/spec/opensearch/1.1/" '
+               'xmlns:issues="http://schemas.google.com/projecthosting/issues/2009">')
+FEED_FOOTER = '</feed>'
+
+EPOCH = datetime.date(2008, 9, 1)
+STATUSES_OPEN = [("Untriaged", 20), ("Available", 30), ("Assigned", 40), ("Started", 10)]
+STATUSES_CLOSED = [("Fixed", 60), ("WontFix", 15), ("Duplicate", 15), ("Verified", 10)]
+PRIORITIES = [(None, 10), ("0", 2), ("1", 18), ("2", 50), ("3", 20)]
+TYPES = [("Bug", 70), ("Feature", 15), ("Launch", 5), ("Bug-Regression", 10)]
+COMPONENTS = ["UI", "Blink", "Internals", "Platform", "Enterprise", "Security", "OS",
+              "Services", "Tests", "Privacy", "Bindings", "Network", "Media", "Sync"]
+
+
+def weighted_choice(rng, choices):
+    """Pick a value from (value, weight) pairs."""
+    total = sum(weight for (_, weight) in choices)
+    r = rng.uniform(0, total)
+    for (value, weight) in choices:
+        r -= weight
+        if r <= 0:
+            return value
+    return choices[-1][0]
+
+class ZipfSampler(object):
+    """Pick indexes in [0, n) with a Zipf distribution (a few very common, then a long tail)."""
+
+    def __init__(self, n, skew=1.0):
+        self._cumulative = []
+        total = 0.0
+        for rank in range(1, n + 1):
+            total += 1.0 / rank ** skew
+            self._cumulative.append(total)
+
+    def sample(self, rng):
+        """Pick an index."""
+        return bisect_left(self._cumulative, rng.uniform(0, self._cumulative[-1]))
+
+
+class SyntheticIssue(object):
+    """The raw fields of a generated issue."""
+
+    def __init__(self, issue_id, owner, status, state, stars, published, updated, closed, labels):
+        self.id = issue_id
+        self.owner = owner
+        self.status = status
+        self.state = state
+        self.stars = stars
+        self.published = published
+        self.updated = updated
+        self.closed = closed
+        self.labels = labels
+
+
+def generate_issues(num_issues, seed=0, today=None):
+    """Generate num_issues issues with realistic label, owner and date distributions.
+
+    The same arguments always give the same issues. Issues are published in
+    id order between EPOCH and `today`; about 70% of them are closed.
+    """
+    rng = random.Random(seed)
+    today = today or datetime.date(2015, 6, 1)
+    span = (today - EPOCH).days
+    owners = ZipfSampler(max(10, num_issues // 50), skew=0.8)
+    components = ZipfSampler(len(COMPONENTS))
+    stars = ZipfSampler(500, skew=1.5)
+    issues = []
+    for issue_id in range(1, num_issues + 1):
+        published = EPOCH + datetime.timedelta(days=span * (issue_id - 1) // num_issues)
+        closed = None
+        if rng.random() < 0.7:
+            closed = min(published + datetime.timedelta(days=int(rng.expovariate(1.0 / 60))),
+                         today)
+        updated = min((closed or published) + datetime.timedelta(days=rng.randint(0, 30)), today)
+        owner = None
+        if rng.random() < 0.75:
+            owner = "dev{n}@chromium.org".format(n=owners.sample(rng))
+
+        labels = []
+        priority = weighted_choice(rng, PRIORITIES)
+        if priority is not None:
+            labels.append("Pri-" + priority)
+        if rng.random() < 0.6:
+            labels.append("M-{m}".format(m=10 + (published - EPOCH).days // 42 + rng.randint(0, 2)))
+        labels.append("Type-" + weighted_choice(rng, TYPES))
+        for _ in range(rng.choice([0, 1, 1, 1, 2, 3])):
+            labels.append("Cr-" + COMPONENTS[components.sample(rng)])
+        if rng.random() < 0.1:
+            labels.append("OS-" + rng.choice(["Windows", "Mac", "Linux", "Android"]))
+
+        issues.append(SyntheticIssue(
+            issue_id, owner,
+            weighted_choice(rng, STATUSES_CLOSED if closed else STATUSES_OPEN),
+            "closed" if closed else "open", stars.sample(rng),
+            published, updated, closed, labels))
+    return issues
+
+def format_datetime(date):
+    """Format a date as a feed datetime."""
+    return date.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+def render_entry(issue):
+    """Render an issue as an Atom feed entry."""
+    parts = ["<entry>",
+             "<id>http://code.google.com/feeds/issues/p/synthetic/issues/full/{id}</id>".format(
+                 id=issue.id),
+             "<published>{date}</published>".format(date=format_datetime(issue.published)),
+             "<updated>{date}</updated>".format(date=format_datetime(issue.updated)),
+             "<title>Issue {id}</title>".format(id=issue.id),
+             "<issues:id>{id}</issues:id>".format(id=issue.id)]
+    for label in issue.labels:
+        parts.append("<issues:label>{label}</issues:label>".format(label=escape(label)))
+    if issue.owner is not None:
+        parts.append("<issues:owner><issues:uri>/u/{owner}/</issues:uri>"
+                     "<issues:username>{owner}</issues:username></issues:owner>".format(
+                         owner=escape(issue.owner)))
+    parts.append("<issues:stars>{stars}</issues:stars>".format(stars=issue.stars))
+    parts.append("<issues:state>{state}</issues:state>".format(state=issue.state))
+    parts.append("<issues:status>{status}</issues:status>".format(status=issue.status))
+    if issue.closed is not None:
+        parts.append("<issues:closedDate>{date}</issues:closedDate>".format(
+            date=format_datetime(issue.closed)))
+    parts.append("</entry>")
+    return "".join(parts)
+
+def render_feed(issues, total_results, next_url=None):
+    """Render a page of the issues feed containing the given issues."""
+    return render_feed_entries([render_entry(issue) for issue in issues], total_results,
+                               next_url)
+
+def render_feed_entries(entries, total_results, next_url=None):
+    """Render a page of the issues feed from already rendered entries."""
+    parts = [FEED_HEADER, "<title>Issues</title>",
+             "<openSearch:totalResults>{total}</openSearch:totalResults>".format(
+                 total=total_results)]
+    if next_url is not None:
+        parts.append('<link rel="next" type="application/atom+xml" href={href}/>'.format(
+            href=quoteattr(next_url)))
+    parts.extend(entries)
+    parts.append(FEED_FOOTER)
+    return "".join(parts)
+
+def generate_pages(issues, page_size=25):
+    """Yield the feed pages for the issues, page_size issues at a time."""
+    for start in range(0, len(issues), page_size):
+        yield render_feed(issues[start:start + page_size], len(issues))
@@ -1,9 +1,12 @@
 """Utilities for working with issues."""
 
-from functools import partial
+import datetime
 
 # TODO(tbuckley) write issue_property_compare_p
 
+ISSUES_NAMESPACE = "{http://schemas.google.com/projecthosting/issues/2009}"
+LABEL_PREFIXES = ("Pri-", "M-", "Type-", "Cr-")
+
 # General value helper functions
 
 def process_pipeline(val, transforms):
@@ -33,100 +36,158 @@ def get_date_for_issue_datestring(datetime):
     (date, _) = datetime.split("T")
     return date
 
+def get_ordinal_for_issue_datestring(datestring):
+    """Get the day ordinal for a Google Code Issue Tracker datetime."""
+    (year, month, day) = get_date_for_issue_datestring(datestring).split("-")
+    return datetime.date(int(year), int(month), int(day)).toordinal()
+
+def get_datestring_for_ordinal(ordinal):
+    """Get the date string (YYYY-MM-DD) for a day ordinal."""
+    return datetime.date.fromordinal(ordinal).isoformat()
+
 # ElemTree getters
 
 def get_text(elem):
     """Get the text for the element."""
     return elem.text
 
+def get_local_tag(elem):
+    """Get the tag for the element without its namespace."""
+    return elem.tag.rsplit("}", 1)[-1]
+
 def get_first_child_by_tag(page, tag):
     """Return the first child of `page` with the given tag."""
     for child in page:
         if child.tag.endswith(tag):
             return child
 
-def get_single_property(tag, page):
-    """Get the single element with the given tag."""
-    return process_pipeline(page, [partial(filter, has_tag_p(tag)),
-                                   ensure_only_one])
+# Issue records
+
+class Issue(object):
+    """An immutable issue, decoded once from a feed entry.
+
+    Dates are stored as day ordinals (see datetime.date.toordinal). Labels are
+    kept in feed order, and the labels for each of LABEL_PREFIXES are also
+    kept split out (with the prefix removed) in `prefixed_labels`.
+    """
+
+    __slots__ = ("id", "owner", "status", "state", "stars", "published", "updated", "closed",
+                 "labels", "prefixed_labels", "priority", "milestone", "type")
+
+    def __init__(self, id, owner=None, status=None, state=None, stars=None, published=None,
+                 updated=None, closed=None, labels=()):
+        labels = tuple(labels)
+        prefixed_labels = dict((prefix, split_labels_by_prefix(prefix, labels))
+                               for prefix in LABEL_PREFIXES)
+        values = {
+            "id": id,
+            "owner": owner,
+            "status": status,
+            "state": state,
+            "stars": stars,
+            "published": published,
+            "updated": updated,
+            "closed": closed,
+            "labels": labels,
+            "prefixed_labels": prefixed_labels,
+            "priority": single_int_label(prefixed_labels["Pri-"]),
+            "milestone": single_int_label(prefixed_labels["M-"]),
+            "type": ensure_only_one(prefixed_labels["Type-"]),
+        }
+        for (name, value) in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Issue is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Issue is immutable")
+
+    def __reduce__(self):
+        return (Issue, (self.id, self.owner, self.status, self.state, self.stars,
+                        self.published, self.updated, self.closed, self.labels))
+
+    def __repr__(self):
+        return "Issue(id={id}, status={status})".format(id=self.id, status=self.status)
+
+def split_labels_by_prefix(prefix, labels):
+    """Get the labels with the given prefix as a tuple. Prefix is removed."""
+    return tuple(label[len(prefix):] for label in labels if label.startswith(prefix))
+
+def single_int_label(values):
+    """Get the single label value as an int. May be None."""
+    return process_pipeline(values, [ensure_only_one, safely_cast_to_int])
+
+def decode_issue(entry):
+    """Decode a feed entry into an Issue, visiting each child element once."""
+    values = {"labels": []}
+    for child in entry:
+        tag = get_local_tag(child)
+        if tag == "id":
+            if child.tag.startswith(ISSUES_NAMESPACE):
+                values["id"] = safely_cast_to_int(child.text)
+        elif tag == "owner":
+            values["owner"] = process_pipeline(get_first_child_by_tag(child, "username"),
+                                               [get_text])
+        elif tag in ("status", "state"):
+            values[tag] = child.text
+        elif tag == "stars":
+            values["stars"] = process_pipeline(child.text, [safely_cast_to_int])
+        elif tag in ("published", "updated"):
+            values[tag] = process_pipeline(child.text, [get_ordinal_for_issue_datestring])
+        elif tag == "closedDate":
+            values["closed"] = process_pipeline(child.text, [get_ordinal_for_issue_datestring])
+        elif tag == "label":
+            values["labels"].append(child.text)
+    return Issue(values.pop("id", None), **values)
 
 # Issue getters
 
-def get_issue_text_property(tag, issue):
-    """Return the text for the property with the given tag."""
-    return process_pipeline(issue, [partial(get_single_property, tag),
-                                    get_text])
-
-def get_issue_int_property(tag, issue):
-    """Return the int value for the property with the given tag."""
-    return process_pipeline(issue, [partial(get_issue_text_property, tag),
-                                    safely_cast_to_int])
-
-def get_issue_date_property(tag, issue):
-    """Return the date value for the property with the given tag."""
-    return process_pipeline(issue, [partial(get_issue_text_property, tag),
-                                    get_date_for_issue_datestring])
-
 def get_issue_owner(issue):
     """Get the owner for the given issue."""
-    return process_pipeline(issue, [partial(get_single_property, "owner"),
-                                    partial(get_issue_text_property, "username")])
+    return issue.owner
 
 def get_issue_status(issue):
     """Get the owner for the given issue."""
-    return get_issue_text_property("status", issue)
+    return issue.status
 
 def get_issue_id(issue):
     """Get the id for the given issue."""
-    id_tag = "{http://schemas.google.com/projecthosting/issues/2009}id"
-    return get_issue_int_property(id_tag, issue)
+    return issue.id
 
 def get_issue_stars(issue):
     """Get the number of stars for the given issue."""
-    return get_issue_int_property("stars", issue)
+    return issue.stars
 
 def get_issue_updated_date(issue):
     """Get the date that the given issue was last updated."""
-    return get_issue_date_property("updated", issue)
+    return process_pipeline(issue.updated, [get_datestring_for_ordinal])
 
 def get_issue_published_date(issue):
     """Get the date that the given issue was published."""
-    return get_issue_date_property("published", issue)
+    return process_pipeline(issue.published, [get_datestring_for_ordinal])
 
 def get_issue_labels(issue):
     """Get the labels for an issue."""
-    return process_pipeline(issue, [partial(filter, has_tag_p("label")),
-                                    partial(map, get_text)])
+    return issue.labels
 
 def get_issue_labels_by_prefix(prefix, issue):
     """Get the labels with the given prefix. Prefix is removed."""
-    has_prefix_p = lambda label: label.startswith(prefix)
-    remove_prefix = lambda label: label[len(prefix):]
-    return process_pipeline(issue, [get_issue_labels,
-                                    partial(filter, has_prefix_p),
-                                    partial(map, remove_prefix)])
-
-def get_single_label_text_value(prefix, issue):
-    """Get the single label with the given prefix. Prefix is removed."""
-    return process_pipeline(issue, [partial(get_issue_labels_by_prefix, prefix),
-                                    ensure_only_one])
-
-def get_single_label_int_value(prefix, issue):
-    """Get the single label with the given prefix. Prefix is removed."""
-    return process_pipeline(issue, [partial(get_single_label_text_value, prefix),
-                                    safely_cast_to_int])
+    if prefix in issue.prefixed_labels:
+        return issue.prefixed_labels[prefix]
+    return split_labels_by_prefix(prefix, issue.labels)
 
 def get_issue_priority(issue):
     """Get the integer priority of the given issue. May be None."""
-    return get_single_label_int_value("Pri-", issue)
+    return issue.priority
 
 def get_issue_milestone(issue):
     """Get the integer priority of the given issue. May be None."""
-    return get_single_label_int_value("M-", issue)
+    return issue.milestone
 
 def get_issue_type(issue):
     """Get the integer priority of the given issue. May be None."""
-    return get_single_label_text_value("Type-", issue)
+    return issue.type
 
 # General predicates
 
@@ -137,15 +198,6 @@ def not_p(pred_fn):
         return not pred_fn(issue)
     return pred
 
-# ElemTree predicates
-
-def has_tag_p(tag):
-    """Return a predicate that tests if an element has the given tag."""
-    def pred(elem):
-        """Test that an element has a specific tag."""
-        return elem.tag.endswith(tag)
-    return pred
-
 # Issue predicates
 
 def issue_property_matches_p(prop_fn, value):
@@ -182,6 +234,10 @@ def issue_is_launch_p(issue):
     """Return a predicate that tests if issue is a launch bug."""
     return issue_has_label_p("Type-Launch")(issue)
 
+def issue_is_open_p(issue):
+    """Test whether the issue is currently open."""
+    return issue.state == "open"
+
 # Misc
 
 def group_issues_by_prop(issues, prop_fn):
@@ -2,35 +2,12 @@
 
 from abc import ABCMeta, abstractmethod
 
+from idset import IdSet
+import profiling
+from quantiles import exact_quantiles
 import utils
 
 
-class IssueSet(object):
-    """A set of issues. Issues can be added and remove."""
-    
-    def __init__(self, issues=None):
-        self._issues = {}
-
-        if issues is not None:
-            for issue in issues:
-                self.add(issue)
-
-    def add(self, issue):
-        """Add an issue to the set."""
-        issue_id = utils.get_issue_id(issue)
-        self._issues[issue_id] = issue
-
-    def remove(self, issue):
-        """Remove an issue from the set."""
-        issue_id = utils.get_issue_id(issue)
-        del self._issues[issue_id]
-
-    @property
-    def list(self):
-        """Return the IssueSet as a python list."""
-        return self._issues.values()
-
-
 class Table(object):
     """Represents tabular data."""
 
@@ -94,25 +71,33 @@ class ChangeTracker(HistoryTracker):
         self._closed_original_issues = None
         self._tracker = []
 
+    @profiling.timed("tracker:change")
     def start(self, date, start_issues):
-        self._original_issues = set([utils.get_issue_id(i) for i in start_issues])
-        self._new_issues = set()
-        self._closed_original_issues = set()
+        self._original_issues = IdSet([utils.get_issue_id(i) for i in start_issues])
+        self._new_issues = IdSet()
+        self._closed_original_issues = IdSet()
         self._tracker.append((date, len(self._closed_original_issues), len(self._new_issues)))
 
+    @profiling.timed("tracker:change")
     def step(self, date, opened_issues, closed_issues):
-        opened_ids = set([utils.get_issue_id(i) for i in opened_issues])
-        closed_ids = set([utils.get_issue_id(i) for i in closed_issues])
-        closed_original = closed_ids.intersection(self._original_issues)
-        self._closed_original_issues = self._closed_original_issues.union(closed_original)
-        self._original_issues = self._original_issues.difference(closed_ids)
-        self._new_issues = self._new_issues.union(opened_ids).difference(closed_ids)
+        opened_ids = [utils.get_issue_id(i) for i in opened_issues]
+        closed_ids = [utils.get_issue_id(i) for i in closed_issues]
+        for issue_id in closed_ids:
+            if issue_id in self._original_issues:
+                self._closed_original_issues.add(issue_id)
+                self._original_issues.discard(issue_id)
+        self._new_issues.update(opened_ids)
+        self._new_issues.difference_update(closed_ids)
         self._tracker.append((date, len(self._closed_original_issues), len(self._new_issues)))
 
+    def rows(self):
+        """Get the (date, fixed, new) rows of the tracker."""
+        return list(self._tracker)
+
     def display(self):
         """Print out the tracker."""
         table = Table(headers=["date", "fixed", "new"])
-        for (date, fixed, new) in self._tracker:
+        for (date, fixed, new) in self.rows():
             table.add_row([date.strftime("%Y/%m/%d"), fixed, new])
         print str(table)
 
@@ -127,44 +112,69 @@ class GridTracker(HistoryTracker):
         2015-01-01  5   8   12
         2015-01-08  7   10  14
         ...
+
+    Only the per-value counts are kept for each date. They are updated from
+    each step's opened/closed issues rather than by regrouping every open issue.
     """
 
     def __init__(self, prop_fn):
         self._prop_fn = prop_fn
-        self._issue_set = None
+        self._keys = None
+        self._counts = None
         self._tracker = []
 
+    def _add(self, issue):
+        """Count an open issue under its property value."""
+        self._remove(issue)
+        key = self._prop_fn(issue)
+        self._keys[utils.get_issue_id(issue)] = key
+        self._counts[key] = self._counts.get(key, 0) + 1
+
+    def _remove(self, issue):
+        """Stop counting an issue, under the value it was counted with."""
+        issue_id = utils.get_issue_id(issue)
+        if issue_id not in self._keys:
+            return
+        key = self._keys.pop(issue_id)
+        self._counts[key] -= 1
+        if self._counts[key] == 0:
+            del self._counts[key]
+
+    @profiling.timed("tracker:grid")
     def start(self, date, start_issues):
         """Start with the given set of issues."""
-        self._issue_set = IssueSet(start_issues)
-        self._tracker.append((date, utils.group_issues_by_prop(start_issues, self._prop_fn)))
+        self._keys = {}
+        self._counts = {}
+        for issue in start_issues:
+            self._add(issue)
+        self._tracker.append((date, dict(self._counts)))
 
+    @profiling.timed("tracker:grid")
     def step(self, date, opened_issues, closed_issues):
         """Add an iteration with the opened/closed issues."""
         for issue in opened_issues:
-            self._issue_set.add(issue)
+            self._add(issue)
         for issue in closed_issues:
-            self._issue_set.remove(issue)
-        groups = utils.group_issues_by_prop(self._issue_set.list, self._prop_fn)
-        self._tracker.append((date, groups))
-
-    def display(self):
-        """Print out the tracker."""
-        table = Table()
+            self._remove(issue)
+        self._tracker.append((date, dict(self._counts)))
 
+    def rows(self):
+        """Get (keys, rows): the sorted values seen, and (date, count for each key) rows."""
         # Join keys from each day to get headers
         keys = set()
-        for (_, issues) in self._tracker:
-            keys = keys.union(issues.keys())
+        for (_, counts) in self._tracker:
+            keys = keys.union(counts.keys())
         keys = list(keys)
         keys.sort()
-        table.set_headers(["date"] + keys)
+        rows = [(date, [counts.get(key, 0) for key in keys]) for (date, counts) in self._tracker]
+        return (keys, rows)
 
-        # Print rows
-        for (date, issues) in self._tracker:
-            date_str = date.strftime("%Y/%m/%d")
-            values = [len(issues.get(key, [])) for key in keys]
-            table.add_row([date_str] + values)
+    def display(self):
+        """Print out the tracker."""
+        (keys, rows) = self.rows()
+        table = Table(headers=["date"] + keys)
+        for (date, values) in rows:
+            table.add_row([date.strftime("%Y/%m/%d")] + values)
         print str(table)
 
 def key_prop(item):
@@ -175,13 +185,14 @@ def len_prop(item):
     """Get the number of issues for the item."""
     return len(item[1])
 
-def print_groups(groups, hint=0, sort_by_issues=False):
+def print_groups(groups, hint=0, sort_by_issues=False, id_fn=utils.get_issue_id):
     """Print the groups.
 
     Arguments:
     - groups: the groups to print (dict)
     - hint: the maximum number of issue IDs to print out
     - sort_by_issues: if True, print groups by the number of issues instead of by the dict keys
+    - id_fn: get the issue ID for an item in a group (e.g. int, if groups hold IDs)
     """
     items = groups.items()
 
@@ -193,7 +204,7 @@ def print_groups(groups, hint=0, sort_by_issues=False):
     for (key, key_issues) in items:
         print "{key}: {num_issues}".format(key=key, num_issues=len(key_issues)),
         if hint > 0:
-            key_ids = [str(utils.get_issue_id(i)) for i in key_issues]
+            key_ids = [str(id_fn(i)) for i in key_issues]
             if len(key_ids) > hint:
                 print "["+" ".join(key_ids[:3])+"...]"
             else:
@@ -201,21 +212,11 @@ def print_groups(groups, hint=0, sort_by_issues=False):
         else:
             print
 
-def print_groups_by_prop(issues, prop_fn, hint=0, sort_by_issues=False):
-    """Print the groups for a property function that returns a single value."""
-    groups = utils.group_issues_by_prop(issues, prop_fn)
-    print_groups(groups, hint=hint, sort_by_issues=sort_by_issues)
-
-def print_groups_by_list_prop(issues, prop_fn, hint=0, sort_by_issues=False):
-    """Print the groups for a property function that returns a list."""
-    groups = utils.group_issues_by_list_prop(issues, prop_fn)
-    print_groups(groups, hint=hint, sort_by_issues=sort_by_issues)
-
 def print_quantiles(values, quantiles, reverse=False):
-    """Print the quantiles for the given values."""
-    sorted_values = sorted(values)
-    if reverse:
-        sorted_values.reverse()
-    for quantile in quantiles:
-        i = int(len(values) * float(quantile) / 100)
-        print "{quant}%: {prop}".format(quant=quantile, prop=sorted_values[i])
+    """Print the quantiles for the given values. None values are ignored."""
+    print_quantile_values(exact_quantiles(values, quantiles, reverse=reverse))
+
+def print_quantile_values(quantile_values):
+    """Print precomputed (quantile, value) pairs."""
+    for (quantile, value) in quantile_values:
+        print "{quant}%: {prop}".format(quant=quantile, prop=value)